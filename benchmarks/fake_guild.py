@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import time
+import discord
+
+
+class _Response():
+    """ Minimal aiohttp response, as far as `discord.HTTPException` needs it. """
+    def __init__(self, status: int, reason: str, retry_after: float = None):
+        self.status = status
+        self.reason = reason
+        self.headers = {}
+        if retry_after is not None:
+            self.headers['Retry-After'] = str(retry_after)
+
+
+class RateLimiter():
+    """ Token bucket per route, answering with 429 like Discord once a bucket is empty. """
+    def __init__(self, rate: float = None, burst: int = 10):
+        self.rate = rate
+        self.burst = burst
+        self.rate_limited = 0
+        self._buckets : dict[object, tuple[float, float]] = {}
+
+    def check(self, route: object):
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        tokens, last = self._buckets.get(route, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[route] = (tokens, now)
+            self.rate_limited += 1
+            retry_after = (1 - tokens) / self.rate
+            raise discord.HTTPException(_Response(429, 'Too Many Requests', retry_after), 'You are being rate limited.')
+        self._buckets[route] = (tokens - 1, now)
+
+
+class FakeRole():
+    def __init__(self, id: int, guild):
+        self.id = id
+        self.guild = guild
+        self.name = f"role{id}"
+        self.mention = f"<@&{id}>"
+
+    def is_default(self) -> bool:
+        return False
+
+    @property
+    def members(self) -> list:
+        # like discord.py, this scans the whole member cache
+        return [member for member in self.guild.members if self.id in member._roles]
+
+
+class FakeMember():
+    def __init__(self, id: int, guild, roles: set[int] = None):
+        self.id = id
+        self.guild = guild
+        self.name = f"user{id}"
+        self.global_name = None
+        self.bot = False
+        self.joined_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.mention = f"<@{id}>"
+        self._roles = roles or set()
+
+    @property
+    def roles(self) -> list[FakeRole]:
+        return [self.guild.get_role(role_id) for role_id in self._roles]
+
+    def get_role(self, role_id: int) -> FakeRole:
+        return self.guild.get_role(role_id) if role_id in self._roles else None
+
+    async def add_roles(self, *roles, reason: str = None):
+        await self.guild._request(('add', self.guild.id))
+        self._roles.update(role.id for role in roles)
+
+    async def remove_roles(self, *roles, reason: str = None):
+        await self.guild._request(('remove', self.guild.id))
+        self._roles.difference_update(role.id for role in roles)
+
+    async def edit(self, *, roles: list = None, reason: str = None):
+        await self.guild._request(('edit', self.guild.id))
+        if roles is not None:
+            self._roles = {role.id for role in roles}
+
+
+class FakeGuild():
+    """
+    Synthetic guild of `members` members and `roles` roles.
+
+    Every role change takes `latency` seconds and is subject to the per-route `rate_limiter`.
+    """
+    def __init__(self, members: int, roles: int = 1, latency: float = 0.0, rate_limiter: RateLimiter = None):
+        self.id = 1
+        self.name = "Benchmark Guild"
+        self.chunked = True
+        self.latency = latency
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.requests = 0
+        self._roles = {role_id: FakeRole(role_id, self) for role_id in range(1, roles + 1)}
+        self._members = {}
+        for member_id in range(1, members + 1):
+            # half of the guild has the first role already
+            initial_roles = {1} if member_id % 2 else set()
+            self._members[member_id] = FakeMember(member_id, self, initial_roles)
+
+    @property
+    def members(self) -> list[FakeMember]:
+        return list(self._members.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self._members)
+
+    @property
+    def roles(self) -> list[FakeRole]:
+        return list(self._roles.values())
+
+    def get_member(self, member_id: int) -> FakeMember:
+        return self._members.get(member_id)
+
+    def get_role(self, role_id: int) -> FakeRole:
+        return self._roles.get(role_id)
+
+    async def _request(self, route: object):
+        self.requests += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.rate_limiter.check(route)
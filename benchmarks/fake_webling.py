@@ -0,0 +1,177 @@
+import asyncio
+import multiprocessing
+import random
+import re
+import time
+from aiohttp import web
+
+MEMBERGROUP_ID = 100
+NEW_MEMBERGROUP_ID = 101
+RESIGNED_MEMBERGROUP_ID = 102
+OTHER_MEMBERGROUP_ID = 103
+
+
+class FakeWebling():
+    """
+    Local stand-in for the parts of the Webling API the bot uses.
+
+    Serves `/member` (with the filters the bot sends), `/member/{id}`, `/replicate` and `/changes/{revision}` for a synthetic club. Every response is delayed by `latency` seconds and at most `rate` requests per second are served, further ones are queued.
+
+    The `/_bench` routes let the benchmark change members and read the request count, as the server runs in its own process, see `start_process`.
+    """
+    def __init__(self, members: int, latency: float = 0.0, rate: float = None, seed: int = 0):
+        self.latency = latency
+        self.rate = rate
+        self.requests = 0
+        self.revision = 1
+        # revision -> ids of members changed in that revision
+        self._changes : dict[int, set[int]] = {}
+        self._random = random.Random(seed)
+        self._next_slot = 0.0
+        self._runner : web.AppRunner = None
+        self.url : str = None
+        self.members = {}
+        for index in range(members):
+            member_id = 10000 + index
+            self.members[member_id] = self._make_member(member_id, index)
+
+    def _make_member(self, member_id: int, index: int) -> dict:
+        roll = self._random.random()
+        # most members are linked by id, some by name only, some not at all
+        discord_id = str(index + 1) if roll < 0.7 else ''
+        discord_name = f"user{index + 1}" if 0.7 <= roll < 0.9 else ''
+        roll = self._random.random()
+        if roll < 0.8:
+            parents = [MEMBERGROUP_ID]
+        elif roll < 0.9:
+            parents = [NEW_MEMBERGROUP_ID]
+        elif roll < 0.95:
+            parents = [RESIGNED_MEMBERGROUP_ID]
+        else:
+            parents = [OTHER_MEMBERGROUP_ID]
+        return {
+            'id': member_id,
+            'type': 'member',
+            'readonly': False,
+            'properties': {
+                'Mitglieder ID': index + 1,
+                'Vorname': f"First{index}",
+                'Name': f"Last{index}",
+                'E-Mail': f"member{index}@example.com",
+                'Discord-ID': discord_id,
+                'Discord-Benutzername': discord_name,
+            },
+            'parents': parents,
+            'children': {},
+            'links': {},
+        }
+
+    def change_members(self, count: int) -> list[int]:
+        """ Moves `count` random members to another membergroup in a new revision. """
+        member_ids = self._random.sample(sorted(self.members), count)
+        self.revision += 1
+        for member_id in member_ids:
+            member = self.members[member_id]
+            member['parents'] = [RESIGNED_MEMBERGROUP_ID] if member['parents'] != [RESIGNED_MEMBERGROUP_ID] else [MEMBERGROUP_ID]
+        self._changes[self.revision] = set(member_ids)
+        return member_ids
+
+    async def start(self, port: int = 0):
+        app = web.Application()
+        app.router.add_get('/api/1/member', self._list_members)
+        app.router.add_get('/api/1/member/{id}', self._get_member)
+        app.router.add_get('/api/1/replicate', self._replicate)
+        app.router.add_get('/api/1/changes/{revision}', self._get_changes)
+        app.router.add_post('/_bench/changes', self._bench_changes)
+        app.router.add_get('/_bench/stats', self._bench_stats)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/api/1"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def _throttle(self):
+        self.requests += 1
+        delay = self.latency
+        if self.rate is not None:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.rate
+            delay += slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _list_members(self, request: web.Request) -> web.Response:
+        await self._throttle()
+        query = request.query.get('filter', '')
+        members = self.members.values()
+
+        match = re.match(r"\$id IN \(([\d, ]*)\)", query)
+        if match:
+            ids = [int(i) for i in match.group(1).split(',') if i.strip()]
+            members = [self.members[i] for i in ids if i in self.members]
+        elif query.startswith("$parents.$id ="):
+            group_id = int(query.split('=')[1].split()[0])
+            members = [m for m in members if group_id in m['parents'] and m['properties']['Discord-ID']]
+        elif 'IS EMPTY' in query:
+            members = [m for m in members if m['properties']['Discord-ID'] or m['properties']['Discord-Benutzername']]
+
+        if request.query.get('format') != 'full':
+            return web.json_response({'objects': [m['id'] for m in members]})
+        return web.json_response(list(members))
+
+    async def _get_member(self, request: web.Request) -> web.Response:
+        await self._throttle()
+        member = self.members.get(int(request.match_info['id']))
+        if member is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response(member)
+
+    async def _replicate(self, request: web.Request) -> web.Response:
+        await self._throttle()
+        return web.json_response({'revision': self.revision})
+
+    async def _get_changes(self, request: web.Request) -> web.Response:
+        await self._throttle()
+        since = int(request.match_info['revision'])
+        changed = set()
+        for revision, member_ids in self._changes.items():
+            if revision > since:
+                changed |= member_ids
+        objects = {'member': sorted(changed)} if changed else []
+        return web.json_response({'objects': objects, 'deleted': [], 'revision': self.revision})
+
+    async def _bench_changes(self, request: web.Request) -> web.Response:
+        member_ids = self.change_members(int(request.query['count']))
+        return web.json_response({'member_ids': member_ids, 'revision': self.revision})
+
+    async def _bench_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'requests': self.requests})
+
+
+def start_process(members: int, latency: float = 0.0, rate: float = None) -> tuple[multiprocessing.Process, str]:
+    """
+    Runs a `FakeWebling` in a separate process, so serializing responses doesn't block the event loop that is measured.
+
+    Returns the process and the base URL of the server, without the API path.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_serve, args=(members, latency, rate, sender), daemon=True)
+    process.start()
+    url = receiver.recv()
+    return process, url
+
+
+def _serve(members: int, latency: float, rate: float, sender):
+    async def main():
+        server = FakeWebling(members, latency, rate)
+        await server.start()
+        sender.send(server.url.removesuffix('/api/1'))
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
@@ -0,0 +1,222 @@
+"""
+Offline benchmark of `sync all`, `sync changes`, `sync resigned` and `autorole all`.
+
+The cogs run against a fake Webling server in a separate process and a synthetic guild, no Discord or Webling account is needed. Run from the repository root:
+
+    python -m benchmarks.run --members 1000 10000 50000
+
+Latency and rate limits of both APIs can be injected, see `--help`.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+import aiohttp
+from types import SimpleNamespace
+from benchmarks.fake_guild import FakeGuild, RateLimiter
+from benchmarks import fake_webling
+from utils.jobs import JobQueue
+from utils.members import MemberCache
+from utils.metrics import metrics
+from utils.writes import WriteScheduler
+
+# ids of the roles in the synthetic guild, mapped roles follow
+MEMBER_ROLE_ID = 1
+AUTOROLE_ID = 2
+# membergroups the mapped roles are assigned to in turn
+MAPPED_MEMBERGROUPS = (fake_webling.NEW_MEMBERGROUP_ID, fake_webling.OTHER_MEMBERGROUP_ID, fake_webling.MEMBERGROUP_ID)
+
+
+class LoopMonitor():
+    """
+    Measures how long the event loop is blocked.
+
+    A task sleeps for `interval` seconds over and over, every wake-up later than that is counted as blocking.
+    """
+    def __init__(self, interval: float = 0.005, threshold: float = 0.01):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self._task : asyncio.Task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.blocked += lag
+
+
+class Benchmark():
+    """ One guild and Webling server of `members` members, on which all scenarios run one after another. """
+    def __init__(self, args, members: int, workdir: str):
+        self.args = args
+        self.members = members
+        self.workdir = workdir
+        self.results : list[dict] = []
+
+    async def run(self) -> list[dict]:
+        process, url = fake_webling.start_process(self.members, self.args.webling_latency, self.args.webling_rate)
+        self.url = url
+        self.http = aiohttp.ClientSession()
+        try:
+            await self._run(url)
+        finally:
+            await self.http.close()
+            process.kill()
+        return self.results
+
+    async def _run(self, url: str):
+        rate_limiter = RateLimiter(self.args.discord_rate, self.args.discord_burst)
+        self.guild = FakeGuild(self.members, roles=2 + self.args.mapped_roles, latency=self.args.discord_latency, rate_limiter=rate_limiter)
+        bot = SimpleNamespace(
+            guild=self.guild,
+            member_cache=MemberCache(),
+            jobs=JobQueue(os.path.join(self.workdir, 'jobs.sqlite3')),
+            writes=WriteScheduler(),
+        )
+        bot.jobs.open()
+        bot.member_cache.start(self.guild)
+
+        self._configure()
+        # the cogs are imported after the environment is configured
+        from cogs import webling_sync
+        from cogs.autorole import autorole
+        autorole.DATA_PATH = os.path.join(self.workdir, 'autorole.json')
+
+        sync = webling_sync.WeblingSync(bot)
+        sync.webling.api_url = url + '/api/1'
+        sync.mirror.open()
+        try:
+            await self._measure("sync all", lambda: self._sync_all(sync))
+            await self.http.post(url + '/_bench/changes', params={'count': max(1, self.members // 100)})
+            await self._measure("sync changes", sync._sync_changes)
+            await self._measure("sync resigned", sync._sync_resigned)
+
+            cog = autorole.Autorole(bot)
+            cog.role = self.guild.get_role(AUTOROLE_ID)
+            await self._measure("autorole all", cog._grant_all_members)
+        finally:
+            await sync.webling.close()
+            sync.mirror.close()
+            bot.jobs.close()
+
+    def _configure(self):
+        os.environ.update({
+            'WEBLING_BASE_DOMAIN': 'benchmark',
+            'WEBLING_API_KEY': 'benchmark',
+            'WEBLING_MEMBERGROUP_ID': str(fake_webling.MEMBERGROUP_ID),
+            'WEBLING_NEW_MEMBERGROUP_ID': str(fake_webling.NEW_MEMBERGROUP_ID),
+            'WEBLING_RESIGNED_MEMBERGROUP_ID': str(fake_webling.RESIGNED_MEMBERGROUP_ID),
+            'WEBLING_DISCORD_MEMBER_ROLE_ID': str(MEMBER_ROLE_ID),
+            'WEBLING_MIRROR_PATH': os.path.join(self.workdir, 'webling.sqlite3'),
+            'WEBLING_STATE_PATH': os.path.join(self.workdir, 'webling_sync.json'),
+            'WEBLING_ROLE_MAPPING': json.dumps({
+                3 + index: [MAPPED_MEMBERGROUPS[index % len(MAPPED_MEMBERGROUPS)]]
+                for index in range(self.args.mapped_roles)
+            }),
+        })
+
+    async def _sync_all(self, cog):
+        # same steps as the `sync all` command
+        async with cog.bot.jobs.lock:
+            plan = await cog._plan_all()
+            return await cog._apply_plan(plan)
+
+    async def _measure(self, scenario: str, run):
+        metrics.reset()
+        webling_before = await self._webling_requests()
+        discord_before = self.guild.requests
+        rate_limited_before = self.guild.rate_limiter.rate_limited
+        monitor = LoopMonitor()
+
+        tracemalloc.start()
+        monitor.start()
+        start = time.perf_counter()
+        await run()
+        wall = time.perf_counter() - start
+        await monitor.stop()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.results.append({
+            'members': self.members,
+            'scenario': scenario,
+            'wall': wall,
+            'webling': await self._webling_requests() - webling_before,
+            'discord': self.guild.requests - discord_before,
+            'rate_limited': self.guild.rate_limiter.rate_limited - rate_limited_before,
+            'changes': int(metrics.counter('role_mutations_total', status="done")),
+            'peak': peak / 2**20,
+            'blocked': monitor.blocked,
+            'max_lag': monitor.max_lag,
+        })
+
+    async def _webling_requests(self) -> int:
+        async with self.http.get(self.url + '/_bench/stats') as response:
+            return (await response.json())['requests']
+
+
+COLUMNS = (
+    # key, title, width, format
+    ('members', "members", 8, "d"),
+    ('scenario', "scenario", 14, ""),
+    ('wall', "wall s", 8, ".2f"),
+    ('webling', "webling", 8, "d"),
+    ('discord', "discord", 8, "d"),
+    ('rate_limited', "429s", 6, "d"),
+    ('changes', "changes", 8, "d"),
+    ('peak', "peak MiB", 9, ".1f"),
+    ('blocked', "blocked s", 10, ".3f"),
+    ('max_lag', "max lag s", 10, ".3f"),
+)
+
+
+def print_table(results: list[dict]):
+    print('  '.join(f"{title:>{width}}" for _, title, width, _ in COLUMNS))
+    for result in results:
+        print('  '.join(f"{result[key]:>{width}{fmt}}" for key, _, width, fmt in COLUMNS))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks the Webling sync and autorole against fake APIs.")
+    parser.add_argument('--members', type=int, nargs='+', default=[1000, 10000, 50000], help="guild and club sizes to benchmark")
+    parser.add_argument('--mapped-roles', type=int, default=0, help="roles mapped to membergroups in addition to the member role")
+    parser.add_argument('--webling-latency', type=float, default=0.0, help="seconds every Webling response is delayed")
+    parser.add_argument('--webling-rate', type=float, default=None, help="Webling requests served per second")
+    parser.add_argument('--discord-latency', type=float, default=0.0, help="seconds every role change takes")
+    parser.add_argument('--discord-rate', type=float, default=None, help="role changes per second and route before Discord answers 429")
+    parser.add_argument('--discord-burst', type=int, default=10, help="role changes per route allowed at once")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    # warnings about unlinked members would drown the table
+    logging.basicConfig(level=logging.ERROR)
+    results = []
+    for members in args.members:
+        with tempfile.TemporaryDirectory() as workdir:
+            results.extend(await Benchmark(args, members, workdir).run())
+    print_table(results)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
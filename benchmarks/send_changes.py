@@ -0,0 +1,35 @@
+"""
+Stand-in for Webling or a relay, which notifies the bot's change receiver about changed members.
+
+    python -m benchmarks.send_changes --port 8080 --secret "..." 123 456
+
+Set `WEBLING_WEBHOOK_PORT` and `WEBLING_WEBHOOK_SECRET` of the bot accordingly. `--burst` sends the notification several times in a row to check that they are coalesced.
+"""
+import argparse
+import asyncio
+import aiohttp
+from utils.webhook import SECRET_HEADER
+
+
+async def send(url: str, member_ids: list[int], secret: str = None, burst: int = 1):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with aiohttp.ClientSession() as session:
+        for _ in range(burst):
+            async with session.post(url, json={'member': member_ids}, headers=headers) as response:
+                print(response.status, await response.text())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sends a Webling change notification to the bot.")
+    parser.add_argument('member_ids', type=int, nargs='*', help="ids of the changed Webling members")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--path', default='/webling/changes')
+    parser.add_argument('--secret', default=None)
+    parser.add_argument('--burst', type=int, default=1, help="number of times the notification is sent")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    asyncio.run(send(f"http://{args.host}:{args.port}{args.path}", args.member_ids, args.secret, args.burst))
@@ -1,10 +1,20 @@
 import os
+import logging
+import json
+import asyncio
+import hashlib
 import pathlib
 import discord
 from discord.ext import commands
 from discord import app_commands
-import requests
 from dotenv import load_dotenv
+from utils.jobs import JobQueue
+from utils.members import MemberCache
+from utils.metrics import MetricsExporter
+from utils.storage import read_json, write_json
+from utils.writes import WriteScheduler
+
+log = logging.getLogger(__name__)
 
 # load token from .env
 load_dotenv()
@@ -12,6 +22,17 @@ TOKEN = os.getenv('DISCORD_TOKEN')
 
 
 DISCORD_GUILD_ID = int(os.getenv('DISCORD_GUILD_ID'))
+# only chunk the members of the guild after startup instead of all guilds before on_ready
+DISCORD_LAZY_CHUNKING = os.getenv('DISCORD_LAZY_CHUNKING', 'false').lower() == 'true'
+# sync commands to the guild only, which makes changes show up instantly
+DISCORD_GUILD_COMMANDS = os.getenv('DISCORD_GUILD_COMMANDS', 'false').lower() == 'true'
+COMMAND_TREE_PATH = os.getenv('COMMAND_TREE_PATH', 'data/command_tree.json')
+JOBS_PATH = os.getenv('JOBS_PATH', 'data/jobs.sqlite3')
+# concurrent Discord writes per rate-limit bucket across all cogs
+DISCORD_WRITES_PER_BUCKET = int(os.getenv('DISCORD_WRITES_PER_BUCKET', 4))
+# optional local exports of the metrics in the Prometheus text format
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+METRICS_PATH = os.getenv('METRICS_PATH') or None
 
 
 intents = discord.Intents.default()
@@ -21,24 +42,69 @@ intents.guild_scheduled_events = True
 
 
 
-bot = commands.Bot(command_prefix=commands.when_mentioned, intents=intents)
+bot = commands.Bot(command_prefix=commands.when_mentioned, intents=intents, chunk_guilds_at_startup=not DISCORD_LAZY_CHUNKING)
+bot.member_cache = MemberCache()
+bot.jobs = JobQueue(JOBS_PATH)
+# every cog submits its role and message writes here, see WriteScheduler
+bot.writes = WriteScheduler(per_bucket=DISCORD_WRITES_PER_BUCKET)
+metrics_exporter = MetricsExporter(port=METRICS_PORT, path=METRICS_PATH)
+
+
+def get_command_tree_hash(guild: discord.Object = None) -> str:
+    """ Hashes the definitions of all app commands that would be synced. """
+    definitions = [command.to_dict(bot.tree) for command in bot.tree.get_commands(guild=guild)]
+    definitions.sort(key=lambda definition: definition['name'])
+    data = json.dumps(definitions, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+async def sync_command_tree(force: bool = False) -> list:
+    """
+    Syncs the command tree, either globally or to the guild.
+
+    Syncing is heavily rate limited, so unless `force` is set it is skipped if the command definitions didn't change since the last sync. Returns the synced commands or None if skipped.
+    """
+    guild = None
+    if DISCORD_GUILD_COMMANDS:
+        guild = discord.Object(id=DISCORD_GUILD_ID)
+        bot.tree.copy_global_to(guild=guild)
+
+    tree_hash = get_command_tree_hash(guild)
+    scope = str(DISCORD_GUILD_ID) if guild else "global"
+    if not force and read_json(COMMAND_TREE_PATH, {}).get(scope) == tree_hash:
+        log.info("Command tree unchanged, skipping sync")
+        return None
+
+    synced = await bot.tree.sync(guild=guild)
+    data = read_json(COMMAND_TREE_PATH, {})
+    data[scope] = tree_hash
+    write_json(COMMAND_TREE_PATH, data)
+    log.info(f"Synced {len(synced)} commands ({scope})")
+    return synced
 
+@bot.event
+async def setup_hook():
+    bot.jobs.open()
+    await metrics_exporter.start()
+    # load cogs once, they don't depend on each other
+    extensions = []
+    for file in pathlib.Path("cogs").rglob("*.py"):
+        if file.stem.startswith("_"):
+            continue
+        extensions.append(".".join(file.with_suffix("").parts))
+    await asyncio.gather(*map(bot.load_extension, extensions))
+    await sync_command_tree()
 
 @bot.event
 async def on_ready():
+    # called again on every reconnect, so keep this idempotent
     guild = bot.get_guild(DISCORD_GUILD_ID)
     if guild is None:
-        print(f"Guild with ID {DISCORD_GUILD_ID} not found")
+        log.warning(f"Guild with ID {DISCORD_GUILD_ID} not found")
     else:
         bot.guild = guild
-    # load cogs
-    for file in pathlib.Path("cogs").rglob("*.py"):
-        if file.stem.startswith("_"):
-            continue
-        await bot.load_extension(".".join(file.with_suffix("").parts))
-    await bot.tree.sync()
+        bot.member_cache.start(guild)
     await bot.change_presence(status=discord.Status.online)
-    print(f'{bot.user} is online!')
+    log.info(f'{bot.user} is online!')
 
 @bot.event
 async def on_message(message: discord.Message) -> None:  # This event is called when a message is sent
@@ -54,10 +120,12 @@ async def ping(ctx: commands.Context) -> None:
 @bot.hybrid_command()
 async def reload(ctx: commands.Context) -> None:
     """Sync commands"""
-    synced = await ctx.bot.tree.sync()
-    await ctx.send(f"Synced {len(synced)} commands globally", ephemeral=True)
+    synced = await sync_command_tree(force=True)
+    scope = "to the guild" if DISCORD_GUILD_COMMANDS else "globally"
+    await ctx.send(f"Synced {len(synced)} commands {scope}", ephemeral=True)
 
-bot.run(TOKEN)
+# log to the root logger, so the logs of the cogs show up as well
+bot.run(TOKEN, root_logger=True)
 
 
 
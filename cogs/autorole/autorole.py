@@ -1,17 +1,41 @@
+import logging
 import discord
-import json
+import asyncio
 import datetime
 from discord.ext import commands, tasks
+from utils.metrics import metrics
+from utils.roles import ADD, RoleExecutor, RoleOperation, log_progress
+from utils.writes import BACKGROUND, BULK, INTERACTIVE, Superseded
+from utils.storage import read_json, write_json
+
+log = logging.getLogger(__name__)
+
+DATA_PATH = 'cogs/autorole/data.json'
+# kind of the autorole jobs in the job queue
+JOB_KIND = "autorole"
 
 class Autorole(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.role : discord.Role = None
+
+        # restore progress of the incremental reconciliation
+        data = read_json(DATA_PATH, {})
+        # members that still need the role, e.g. because granting it failed or it was taken away
+        self.pending : set[int] = set(data.get('pending', []))
+        # every member that joined before this time has been processed
+        high_water_mark = data.get('high_water_mark')
+        self.high_water_mark = datetime.datetime.fromisoformat(high_water_mark) if high_water_mark else None
+        # joins are tracked by events from here on, reset by every new gateway session
+        self.watching_since = discord.utils.utcnow()
+        self._resume_task : asyncio.Task = None
     
     async def cog_load(self):
         self.catch_missed_members.start()
+        self._resume_task = asyncio.create_task(self._resume_grant())
     
     async def cog_unload(self):
+        self._resume_task.cancel()
         self.catch_missed_members.stop()
 
     @commands.hybrid_group()
@@ -26,11 +50,40 @@ class Autorole(commands.Cog):
 
         await ctx.send(f"Changed autorole to <@&{role.id}>.")
 
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # joins during a reconnect that couldn't resume the session are never dispatched
+        self.watching_since = discord.utils.utcnow()
+
     @commands.Cog.listener()
     async def on_member_join(self, member):
         if not member.bot:  # exclude Bots
             role = self._get_role()
-            await member.add_roles(role)
+            operation = RoleOperation(member, role, ADD)
+            try:
+                # overtakes bulk jobs waiting for the same rate limit
+                await self.bot.writes.submit(operation.apply, operation.bucket, INTERACTIVE, operation.keys)
+            except Superseded:
+                # a newer change of the role decides
+                pass
+            except discord.HTTPException:
+                # retry with the next reconciliation
+                self.pending.add(member.id)
+                self._save()
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # only track members that lost a role, most updates are about something else
+        lost_role_ids = {role.id for role in before.roles} - {role.id for role in after.roles}
+        if after.bot or not lost_role_ids:
+            return
+        try:
+            role = self._get_role()
+        except self.RoleNotDefined:
+            return
+        if role.id in lost_role_ids:
+            self.pending.add(after.id)
+            self._save()
 
     @autorole.command(name="all")
     async def autorole_all(self, ctx) -> None:
@@ -39,33 +92,108 @@ class Autorole(commands.Cog):
         # give bot time to make API calls
         await ctx.defer()
 
+        if not await self.bot.member_cache.wait(timeout=60):
+            await ctx.send("Member cache is still loading, please try again later.")
+            return
+
+        if self.bot.jobs.lock.locked():
+            await ctx.send("Another job is running, please try again later.")
+            return
+
         role = self._get_role()
-        await self._grant_all_members()
-        await ctx.send(f"Successfully granted all members <@&{role.id}>.")
+        results = await self._grant_all_members()
+        failed = len(results.forbidden) + len(results.failed)
+        if failed > 0:
+            await ctx.send(f"Granted {len(results.added)} members <@&{role.id}>, {failed} could not be modified.")
+        else:
+            await ctx.send(f"Successfully granted all members <@&{role.id}>.")
 
 
     @tasks.loop(time=datetime.time(hour=3)) # schedule daily for 3am
     async def catch_missed_members(self):
-        await self._grant_all_members()
+        await self._grant_missed_members()
 
     async def _grant_all_members(self):
+        """ Grants the role to every member of the guild that is missing it. """
         guild : discord.Guild = self.bot.guild
-        members = guild.members
+        return await self._grant_members(guild.members)
+
+    async def _grant_missed_members(self):
+        """
+        Grants the role only to members that might have been missed since the last run.
+
+        These are pending members and, if the bot wasn't watching joins the whole time since the last run, members that joined in the meantime.
+        """
+        await self.bot.member_cache.wait()
+        guild : discord.Guild = self.bot.guild
+        candidates = {}
+        for member_id in self.pending:
+            member = guild.get_member(member_id)
+            if member is not None:
+                candidates[member_id] = member
+
+        if self.high_water_mark is None or self.high_water_mark < self.watching_since:
+            for member in guild.members:
+                if member.joined_at is None or self.high_water_mark is None or member.joined_at >= self.high_water_mark:
+                    candidates[member.id] = member
+
+        return await self._grant_members(candidates.values(), BACKGROUND)
+
+    async def _grant_members(self, members, priority: int = BULK):
         role = self._get_role()
+        started_at = discord.utils.utcnow()
+        members = list(members)
 
+        operations = []
         for member in members:
             if not member.bot:  # exclude Bots
-                if role not in member.roles:
-                    await member.add_roles(role)
+                if member.get_role(role.id) is None:
+                    operations.append(RoleOperation(member, role, ADD))
+
+        # run as checkpointed job, so it is resumed after a restart
+        async with self.bot.jobs.lock:
+            with metrics.timer('sync_stage_seconds', kind="autorole", stage="apply"):
+                results = await self.bot.jobs.run(JOB_KIND, operations, self._make_role_executor(priority))
+
+        # keep members with transient errors or superseded grants for the next run
+        handled = {member.id for member in members}
+        self.pending = (self.pending - handled) | {o.member.id for o in results.failed + results.superseded}
+        self.high_water_mark = started_at
+        self._save()
+
+        return results
+
+    async def _resume_grant(self):
+        """ Finishes an autorole job that was interrupted by a restart. """
+        await self.bot.member_cache.wait()
+        async with self.bot.jobs.lock:
+            resumed = await self.bot.jobs.resume(JOB_KIND, self.bot.guild, self._make_role_executor(BACKGROUND))
+        if resumed is not None:
+            _, results = resumed
+            log.info(f"Resumed autorole: {len(results.added)} granted")
+
+    def _make_role_executor(self, priority: int = BULK) -> RoleExecutor:
+        return RoleExecutor(reason="Autorole", progress=log_progress("Autorole"), scheduler=self.bot.writes, priority=priority)
+
+    def _save(self):
+        data = read_json(DATA_PATH, {})
+        data['pending'] = sorted(self.pending)
+        data['high_water_mark'] = self.high_water_mark.isoformat() if self.high_water_mark else None
+        write_json(DATA_PATH, data)
 
     def _set_role(self, role: discord.Role):
         # save for persistency
-        data = {'role' : role.id}
-        with open('cogs/autorole/data.json', 'w') as file:
-            json.dump(data, file)
+        data = read_json(DATA_PATH, {})
+        data['role'] = role.id
+        write_json(DATA_PATH, data)
         
         # save to class for caching
         self.role = role
+
+        # progress was made for the old role, the next run checks every member for the new one
+        self.high_water_mark = None
+        self.pending.clear()
+        self._save()
         
     def _get_role(self) -> discord.Role:
         # try to retrieve cached
@@ -73,14 +201,17 @@ class Autorole(commands.Cog):
             return self.role
         
         else: # else try to load from file
-            with open('cogs/autorole/data.json', 'r') as file:
-                data = json.load(file)
+            data = read_json(DATA_PATH, {})
+            if 'role' not in data:
+                raise self.RoleNotDefined()
             
             role_id = int(data['role'])
             guild = self.bot.guild
             role = guild.get_role(role_id)
 
             if role is not None:
+                # cache, member updates look it up for every event
+                self.role = role
                 return role
             else:
                 raise self.RoleNotDefined()
@@ -92,4 +223,4 @@ async def setup(bot):
     await bot.add_cog(Autorole(bot))
 
 async def teardown(bot):
-    print("Extension unloaded!")
\ No newline at end of file
+    log.info("Extension unloaded!")
@@ -1,9 +1,31 @@
 import os
+import json
+import logging
 import time
-import requests
+import asyncio
 import discord
+from typing import Literal
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
+from utils.members import MemberIndex
+from utils.metrics import metrics
+from utils.mirror import MemberMirror
+from utils.report import Report
+from utils.storage import read_json, write_json
+from utils.scheduler import AdaptiveSchedule
+from utils.roles import RoleEdit, RoleExecutor, RoleOperation, RoleOutcome, RoleResults, log_progress, reconcile, role_change
+from utils.webhook import ChangeReceiver
+from utils.writes import BACKGROUND, BULK, INTERACTIVE, Superseded
+from utils.webling import WeblingCache, WeblingClient, WeblingMember
+
+log = logging.getLogger(__name__)
+
+# plans can only be applied for this many seconds
+PLAN_MAX_AGE = 15 * 60
+# rough estimate of how many role changes Discord's rate limits allow
+ROLE_CHANGES_PER_SECOND = 5
+# kind of the sync jobs in the job queue
+JOB_KIND = "webling_sync"
 
 
 class WeblingSync(commands.Cog):
@@ -15,23 +37,97 @@ class WeblingSync(commands.Cog):
         base_domain = str(os.getenv('WEBLING_BASE_DOMAIN'))
         self.api_url = "https://" + base_domain + ".webling.ch/api/1"
         apikey = str(os.getenv('WEBLING_API_KEY'))
-        self.api_header = {'apikey':apikey}
+        self.webling = WeblingClient(
+            self.api_url,
+            apikey,
+            timeout=float(os.getenv('WEBLING_TIMEOUT', 30)),
+            connect_timeout=float(os.getenv('WEBLING_CONNECT_TIMEOUT', 10)),
+            max_concurrency=int(os.getenv('WEBLING_MAX_CONCURRENCY', 4)),
+            # every request counts against the API budget, no matter which command or job sent it
+            on_request=lambda: self.schedule.spend(1),
+        )
+        self.webling_cache = WeblingCache(self.webling, maxsize=int(os.getenv('WEBLING_CACHE_SIZE', 1024)))
+        self.chunk_size = int(os.getenv('WEBLING_CHUNK_SIZE', 100))
         membergroup_id = int(os.getenv('WEBLING_MEMBERGROUP_ID'))
+        self.membergroup_id = membergroup_id
         new_membergroup_id = int(os.getenv('WEBLING_NEW_MEMBERGROUP_ID'))
         self.resigned_membergroup_id = int(os.getenv('WEBLING_RESIGNED_MEMBERGROUP_ID'))
-        self.valid_membergroups = (membergroup_id, new_membergroup_id)
+        self.valid_membergroups = frozenset((membergroup_id, new_membergroup_id))
         self.discord_member_role_id = int(os.getenv('WEBLING_DISCORD_MEMBER_ROLE_ID'))
+        # maps Discord role ids to the membergroups whose members get the role, the member role is always mapped
+        role_mapping = json.loads(os.getenv('WEBLING_ROLE_MAPPING') or '{}')
+        self.role_mapping : dict[int, frozenset[int]] = {int(role_id): frozenset(map(int, groups)) for role_id, groups in role_mapping.items()}
+        self.role_mapping[self.discord_member_role_id] = self.valid_membergroups
+        self.mapped_membergroups = frozenset().union(*self.role_mapping.values())
+        self.role_workers = int(os.getenv('DISCORD_ROLE_WORKERS', 8))
+        self.member_index = MemberIndex()
+        self.mirror = MemberMirror(os.getenv('WEBLING_MIRROR_PATH', 'data/webling.sqlite3'))
+        self.state_path = os.getenv('WEBLING_STATE_PATH', 'data/webling_sync.json')
+        # optional receiver of pushed change notifications
+        webhook_port = os.getenv('WEBLING_WEBHOOK_PORT')
+        self.change_receiver = ChangeReceiver(
+            self._sync_notified_changes,
+            int(webhook_port),
+            host=os.getenv('WEBLING_WEBHOOK_HOST', '127.0.0.1'),
+            secret=os.getenv('WEBLING_WEBHOOK_SECRET') or None,
+            debounce=float(os.getenv('WEBLING_WEBHOOK_DEBOUNCE', 5)),
+        ) if webhook_port else None
+        budget = os.getenv('WEBLING_API_BUDGET')
+        max_interval = float(os.getenv('WEBLING_SYNC_MAX_INTERVAL', 4 * 60 * 60))
+        self.schedule = AdaptiveSchedule(
+            interval=float(os.getenv('WEBLING_SYNC_INTERVAL', 60 * 60)),
+            # with pushed changes, polling is only a safety net
+            min_interval=max_interval if self.change_receiver else float(os.getenv('WEBLING_SYNC_MIN_INTERVAL', 5 * 60)),
+            max_interval=max_interval,
+            budget=int(budget) if budget else None,
+        )
+        self.sync_autostart = os.getenv('WEBLING_SYNC_AUTOSTART', 'true').lower() == 'true'
         
-        # never synced
-        self.last_sync = 1
-        self.last_results = None
+        # restore results of the last sync, the sync revision itself is stored in the mirror
+        self.last_results = self._load_results()
+        # Discord-IDs of resigned members whose roles were synced already
+        self.resigned_handled : set[int] = set(read_json(self.state_path, {}).get('resigned_handled', []))
+        # last plan of `sync plan`, waiting to be applied
+        self.plan = None
+        self._resume_task : asyncio.Task = None
 
     async def cog_load(self):
-        # self.sync_loop.start()
-        pass
+        self.mirror.open()
+        self._resume_task = asyncio.create_task(self._resume_sync())
+        if self.sync_autostart:
+            self.sync_loop.start()
+        if self.change_receiver is not None:
+            await self.change_receiver.start()
     
     async def cog_unload(self):
+        self._resume_task.cancel()
         self.sync_loop.stop()
+        if self.change_receiver is not None:
+            await self.change_receiver.close()
+        await self.webling.close()
+        self.mirror.close()
+
+    @property
+    def last_sync(self) -> int:
+        """ Webling revision of the last sync, None if never synced. """
+        return self.mirror.revision
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.member_index.add(member)
+        if not member.bot:
+            await self._grant_on_join(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.member_index.remove(member)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # names belong to the user, renames aren't visible in on_member_update
+        member = self.bot.guild.get_member(after.id)
+        if member is not None:
+            self.member_index.update(before, member)
 
     @commands.hybrid_group()
     async def sync(self, ctx: commands.Context) -> None:
@@ -39,170 +135,335 @@ class WeblingSync(commands.Cog):
         await ctx.send("This is just a group. Please supply subcommand.")
 
     @sync.command(name="all")
-    async def sync_all_members(self, ctx: commands.Context) -> None:
+    async def sync_all_members(self, ctx: commands.Context, csv: bool = False) -> None:
         """
         Removes role from everyone and re-add it to everyone eligible.
         """
-        print(f"{ctx.author} called sync changes.")
-
-        guild = ctx.message.guild
+        log.info(f"{ctx.author} called sync all.")
         
         # give bot time to make API calls
         await ctx.defer()
 
-        role = guild.get_role(self.discord_member_role_id)
+        if not await self.bot.member_cache.wait(timeout=60):
+            await ctx.send("Member cache is still loading, please try again later.")
+            return
 
-        if role is None:
-            await ctx.send("Error: Role-ID not found")
+        if self.bot.jobs.lock.locked():
+            await ctx.send("Another sync job is running, please try again later.")
             return
 
-        current_role_users = role.members
-        all_users = guild.members
-        
-        # get all eligible members
-        eligible_members = await self._get_eligible_members()
+        async with self.bot.jobs.lock:
+            try:
+                plan = await self._plan_all()
+            except self.RoleNotFound:
+                await ctx.send("Error: Role-ID not found")
+                return
+            except self.NoEligibleMembers:
+                await ctx.send("No eligible members.")
+                return
+
+            results = await self._apply_plan(plan)
+        await self._make_all_report(plan, results).send(ctx, attach_csv=csv)
+
+    @sync.command(name="plan")
+    async def sync_plan(self, ctx: commands.Context, kind: Literal["all", "changes"] = "changes", csv: bool = False) -> None:
+        """
+        Shows what `sync all` or `sync changes` would do without changing any roles.
+        """
+        log.info(f"{ctx.author} called sync plan {kind}.")
+
+        # give bot time to make API calls
+        await ctx.defer()
 
-        if eligible_members is None:
-            await ctx.send("No eligible members.")
+        if not await self.bot.member_cache.wait(timeout=60):
+            await ctx.send("Member cache is still loading, please try again later.")
             return
 
-        old : list[str] = []
-        new : list[discord.member] = []
-        not_found : list[int] = []
-        removed : list[discord.member] = []
-        forbidden : list[str] = []
+        if self.bot.jobs.lock.locked():
+            await ctx.send("Another sync job is running, please try again later.")
+            return
 
-        for member in eligible_members:
-            # TODO: these properties should be envs
-            member_id = str(member['properties']['Mitglieder ID'])
-            
+        async with self.bot.jobs.lock:
             try:
-                user = self._get_user_by_member(member)
-            except self.UserNotFound:
-                # if that failes, add to not_found
-                print(f"Discord user of member {member_id} not found.")
-                not_found.append(member_id)
-            else:   # user found
+                plan = await (self._plan_all() if kind == "all" else self._plan_changes())
+            except self.RoleNotFound:
+                await ctx.send("Error: Role-ID not found")
+                return
+            except self.NoEligibleMembers:
+                await ctx.send("No eligible members.")
+                return
+
+        self.plan = plan
+        await self._make_plan_report(plan).send(ctx, "Use `sync apply` to apply this plan.", attach_csv=csv)
+
+    @sync.command(name="apply")
+    async def sync_apply(self, ctx: commands.Context, csv: bool = False) -> None:
+        """
+        Applies the plan of the last `sync plan` without fetching from Webling again.
+        """
+        log.info(f"{ctx.author} called sync apply.")
 
-                # check if user already has role
-                if user not in current_role_users:
-                    # if not, try to add role
-                    try:
-                        await user.add_roles(role)
-                        new.append(user)
-                    except discord.errors.Forbidden:
-                        # if that fails, add to forbidden
-                        print(f"Not allowed to add role to user {user.name}")
-                        forbidden.append(user.name)
-                else:   #if user already has role
-                    # keep track of not eligible users with role
-                    current_role_users.remove(user)
-                    # add to old members
-                    old.append(user.name)
-
-        # remove role from everyone not eligible
-        for user in current_role_users:
-            try:
-                await user.remove_roles(role)
-                removed.append(user)
-            except discord.errors.Forbidden:
-                # add to forbidden
-                print(f"Not allowed to remove role from user {user.name}")
-                forbidden.append(user.name)
+        plan = self.plan
+        if plan is None:
+            await ctx.send("No plan to apply. Create one with `sync plan`.")
+            return
+        if plan.revision != self.mirror.revision or time.time() - plan.time > PLAN_MAX_AGE:
+            self.plan = None
+            await ctx.send("Plan is outdated. Create a new one with `sync plan`.")
+            return
+
+        if self.bot.jobs.lock.locked():
+            await ctx.send("Another sync job is running, please try again later.")
+            return
+
+        # give bot time to make API calls
+        await ctx.defer()
+
+        self.plan = None
+        async with self.bot.jobs.lock:
+            results = await self._apply_plan(plan)
+        if plan.kind == "all":
+            await self._make_all_report(plan, results).send(ctx, attach_csv=csv)
+        else:
+            changes_results = self._make_changes_results(plan, results)
+            self._save_results(changes_results)
+            await changes_results.make_report().send(ctx, attach_csv=csv)
 
-        # set last sync time for sync loop
-        self.last_sync = int(time.time())
+    def _make_all_report(self, plan, results: RoleResults) -> Report:
+        old = plan.unchanged
+        new : list[discord.Member] = [o.member for o in results.added]
+        removed : list[discord.Member] = [o.member for o in results.removed]
+        not_found = plan.not_found
+        forbidden : list[str] = [o.member.name for o in results.forbidden + results.failed]
 
         # sent sync report
-        embed = discord.Embed(title="Sync All Report", color=0x009260)
-        embed.add_field(name=f"Old Members ({len(old)})", value="")
-        embed.add_field(name=f"New Members ({len(new)})", value=self._list_members(new))
-        embed.add_field(name=f"Removed Members ({len(current_role_users)})", value=self._list_members(removed))
+        report = Report("Sync All Report", 0x009260)
+        report.add_field(f"Old Members ({len(old)})", "Not listed")
+        report.add_list(f"New Members ({len(new)})", new, self._mention)
+        report.add_list(f"Removed Members ({len(removed)})", removed, self._mention)
 
         if len(not_found) > 0:
-            val = ', '.join(list(map(str, not_found)))
-            val = self._trucate_str(val)
-            
-            embed.add_field(name=f"Member IDs with unmatched discord references ({len(not_found)})", value=f"{val}", inline=True)
+            report.add_list(f"Member IDs with unmatched discord references ({len(not_found)})", not_found)
 
         if len(forbidden) > 0:
-            val = ', '.join(list(map(str, forbidden)))
-            val = self._trucate_str(val)
+            report.add_list(f"Discord users that could not be modified ({len(forbidden)})", forbidden)
 
-            embed.add_field(name=f"Discord users that could not be modified ({len(forbidden)})", value=f"{val}", inline=True)
+        return report
 
-        await ctx.send(embed=embed)
+    def _make_plan_report(self, plan) -> Report:
+        to_add = [o.member for o in plan.operations if o.added_roles]
+        to_remove = [o.member for o in plan.operations if o.removed_roles]
+        duration = int(plan.estimate_duration())
 
-    def _list_members(self, members):
-        def mention(member : discord.member):
-            return f'<@{member.id}>'
+        report = Report(f"Sync {plan.kind.capitalize()} Plan", 0x333438)
+        report.add_field(f"Unchanged Members ({len(plan.unchanged)})", "Not listed")
+        report.add_list(f"Members to add ({len(to_add)})", to_add, self._mention)
+        report.add_list(f"Members to remove ({len(to_remove)})", to_remove, self._mention)
 
-        val = ','.join(list(map(mention, members)))
-        return self._trucate_str(val)
+        if len(plan.not_found) > 0:
+            report.add_list(f"Member IDs with unmatched discord references ({len(plan.not_found)})", plan.not_found)
 
-    def _trucate_str(self, s):
-        lim = 1024
-        delim = ','
-        if len(s) > lim:
-            s = s[:(lim-4)] + '..'
-            return s.rsplit(delim, 1)[0]
-        else:
-            return s
+        report.add_field("Estimated cost", f"{len(plan.operations)} API calls, about {duration // 60}m {duration % 60}s", inline=False)
+        return report
+
+    @staticmethod
+    def _mention(member: discord.Member) -> str:
+        return f'<@{member.id}>'
 
 
     @sync.command(name="changes")
-    async def sync_changes(self, ctx: commands.Context) -> None:
+    async def sync_changes(self, ctx: commands.Context, csv: bool = False) -> None:
         """
         Syncs all changed members since last sync. 
         """
-        print(f"{ctx.author} called sync changes.")
+        log.info(f"{ctx.author} called sync changes.")
         # give bot time to make API calls
         await ctx.defer()
+
+        if not await self.bot.member_cache.wait(timeout=60):
+            await ctx.send("Member cache is still loading, please try again later.")
+            return
+
+        if self.bot.jobs.lock.locked():
+            await ctx.send("Another sync job is running, please try again later.")
+            return
+
         results =  await self._sync_changes()
+        self._save_results(results)
 
-        embed = results.make_embed()
+        await results.make_report().send(ctx, attach_csv=csv)
 
-        await ctx.send(embed=embed)
+    @sync.command(name="resigned")
+    async def sync_resigned(self, ctx: commands.Context, csv: bool = False) -> None:
+        """
+        Removes the roles of resigned members, fetched with a single Webling request.
+        """
+        log.info(f"{ctx.author} called sync resigned.")
+        # give bot time to make API calls
+        await ctx.defer()
+
+        if not await self.bot.member_cache.wait(timeout=60):
+            await ctx.send("Member cache is still loading, please try again later.")
+            return
+
+        if self.bot.jobs.lock.locked():
+            await ctx.send("Another sync job is running, please try again later.")
+            return
+
+        try:
+            results = await self._sync_resigned()
+        except self.RoleNotFound:
+            await ctx.send("Error: Role-ID not found")
+            return
+
+        await results.make_report().send(ctx, attach_csv=csv)
 
     @tasks.loop(minutes=60)
     async def sync_loop(self):
-        results = await self._sync_changes()
-        self.last_results = results
+        """
+        Syncs changes on an adaptive schedule, see `AdaptiveSchedule`.
+
+        Errors are logged and retried with backoff, so the loop never fails for good.
+        """
+        start = time.monotonic()
+        if not self.schedule.has_budget():
+            log.warning(f"Webling API budget of {self.schedule.budget} calls per hour is spent, postponing sync.")
+        else:
+            changes = metrics.counter('webling_changed_members_total')
+            try:
+                results = await self._sync_changes(BACKGROUND)
+                # safety net for resigned members whose change was missed
+                await self._sync_resigned(BACKGROUND)
+            except Exception:
+                log.exception("Scheduled sync failed.")
+                self.schedule.failed()
+            else:
+                self._save_results(results)
+                self.schedule.succeeded(metrics.counter('webling_changed_members_total') - changes)
+
+        # the interval counts from the start of the run, the delay from its end
+        delay = self.schedule.next_delay()
+        self.sync_loop.change_interval(seconds=time.monotonic() - start + delay)
+        log.info(f"Next sync in {delay:.0f}s.")
+
+    @sync_loop.before_loop
+    async def before_sync_loop(self):
+        await self._wait_resumed()
 
     @sync.command(name="results")
-    async def sync_results(self, ctx : commands.Context) -> None:
+    async def sync_results(self, ctx : commands.Context, csv: bool = False) -> None:
         """Prints the last sync changes results."""
-        print(f"{ctx.author} called sync results.")
+        log.info(f"{ctx.author} called sync results.")
+        if self.last_results is None:
+            await ctx.send("No sync results yet.")
+        else:
+            await self.last_results.make_report().send(ctx, attach_csv=csv)
+
+    @sync.command(name="stats")
+    async def sync_stats(self, ctx : commands.Context) -> None:
+        """Shows timings and counters of Webling requests, role changes, lookups and sync stages."""
+        log.info(f"{ctx.author} called sync stats.")
+
+        embed = discord.Embed(title="Sync Stats", color=0x333438)
+        embed.description = f"Since {time.ctime(metrics.started)}"
+
+        lines = []
+        for labels, histogram in sorted(metrics.select('webling_request_seconds'), key=lambda item: item[0]['endpoint']):
+            endpoint = labels['endpoint']
+            errors = metrics.counter('webling_requests_total', endpoint=endpoint) - metrics.counter('webling_requests_total', endpoint=endpoint, status=200)
+            kib = metrics.counter('webling_bytes_total', endpoint=endpoint) / 1024
+            lines.append(f"`{endpoint}`: {self._format_histogram(histogram)}, {int(errors)} failed, {kib:.0f} KiB")
+        embed.add_field(name="Webling requests", value='\n'.join(lines) or "None", inline=False)
+
+        cache = (
+            f"{int(metrics.counter('webling_cache_total', result='hit'))} hits, "
+            f"{int(metrics.counter('webling_cache_total', result='shared'))} shared, "
+            f"{int(metrics.counter('webling_cache_total', result='miss'))} misses, "
+            f"{len(self.webling_cache)} entries"
+        )
+        embed.add_field(name="Webling cache", value=cache, inline=False)
+
+        lines = []
+        for labels, histogram in sorted(metrics.select('role_mutation_seconds'), key=lambda item: item[0]['action']):
+            action = labels['action']
+            statuses = ', '.join(
+                f"{int(metrics.counter('role_mutations_total', action=action, status=status))} {status}"
+                for status in (RoleOutcome.DONE, RoleOutcome.FORBIDDEN, RoleOutcome.NOT_FOUND, RoleOutcome.FAILED, RoleOutcome.SUPERSEDED)
+            )
+            lines.append(f"`{action}`: {self._format_histogram(histogram)} ({statuses})")
+        lines.append(f"{int(metrics.counter('role_retries_total'))} retries, {int(metrics.counter('discord_rate_limited_total'))} rate limited")
+        for labels, histogram in sorted(metrics.select('discord_write_wait_seconds'), key=lambda item: item[0]['priority']):
+            lines.append(f"`{labels['priority']}` queue wait: {self._format_histogram(histogram)}")
+        embed.add_field(name="Role changes", value='\n'.join(lines), inline=False)
+
+        lookups = (
+            f"{int(metrics.counter('member_lookups_total', method='id'))} by ID, "
+            f"{int(metrics.counter('member_lookups_total', method='name'))} by name, "
+            f"{int(metrics.counter('member_lookups_total', method='miss'))} unmatched"
+        )
+        embed.add_field(name="Member lookups", value=lookups, inline=False)
+
+        lines = []
+        for labels, histogram in sorted(metrics.select('sync_stage_seconds'), key=lambda item: (item[0]['kind'], item[0]['stage'])):
+            lines.append(f"`{labels['kind']} {labels['stage']}`: {self._format_histogram(histogram)}")
+        embed.add_field(name="Stages", value='\n'.join(lines) or "None", inline=False)
+
+        await ctx.send(embed=embed)
+
+    @staticmethod
+    def _format_histogram(histogram) -> str:
+        if histogram.count == 0:
+            return "0 calls"
+        avg = histogram.sum / histogram.count * 1000
+        p95 = histogram.quantile(0.95) * 1000
+        return f"{histogram.count} calls, avg {avg:.0f}ms, p95 <{p95:.0f}ms"
+
+    def _load_results(self):
+        data = read_json(self.state_path, {})
+        if data.get('last_results') is None:
+            return None
+        return self.SyncChangesResults.from_dict(data['last_results'])
+
+    def _save_results(self, results):
+        self.last_results = results
+        data = read_json(self.state_path, {})
+        data['last_results'] = results.to_dict()
+        write_json(self.state_path, data)
+
+    def _save_resigned_handled(self):
+        data = read_json(self.state_path, {})
+        data['resigned_handled'] = sorted(self.resigned_handled)
+        write_json(self.state_path, data)
 
     
     @sync.command(name="on")
     async def sync_on(self, ctx : commands.Context) -> None:
         """Turns on the sync loop."""
-        print(f"{ctx.author} called sync on.")
+        log.info(f"{ctx.author} called sync on.")
         try:
             self.sync_loop.start()
         except RuntimeError as e:
             await ctx.send(f"{e.args[0]}")
         else:
-            print("Sync task has been launched successfully.")
+            log.info("Sync task has been launched successfully.")
             await ctx.send("Task has been launched successfully.")
     
     @sync.command(name="off")
     async def sync_off(self, ctx : commands.Context) -> None:
         """Shuts the sync loop down."""
-        print(f"{ctx.author} called sync off.")
+        log.info(f"{ctx.author} called sync off.")
         try:
             self.sync_loop.stop()
         except Exception as e:
             await ctx.send(f"{e.args[0]}")
         else:
-            print("Sync task is stopping gracefully.")
+            log.info("Sync task is stopping gracefully.")
             await ctx.send("Task is stopping gracefully.")
 
     @sync.command(name="status")
     async def sync_status(self, ctx : commands.Context) -> None:
         """Returns the current status of the sync loop."""
-        print(f"{ctx.author} called sync status.")
+        log.info(f"{ctx.author} called sync status.")
         is_running = self.sync_loop.is_running()
         has_failed = self.sync_loop.failed()
 
@@ -216,88 +477,315 @@ class WeblingSync(commands.Cog):
         else:
             embed.title = "Task has stopped."
             embed.colour = 0x333438
+
+        if is_running and self.sync_loop.next_iteration is not None:
+            embed.description = f"Next sync {discord.utils.format_dt(self.sync_loop.next_iteration, 'R')}"
+        budget = "unlimited" if self.schedule.budget is None else self.schedule.budget
+        embed.add_field(name="Webling calls last hour", value=f"{self.schedule.spent} of {budget}")
         
         await ctx.send(embed=embed)
 
-    async def _sync_changes(self):
+    async def _sync_changes(self, priority: int = BULK, member_ids: set[int] = frozenset()):
         """  
-        Syncs changed members. 
+        Syncs changed members and the members with `member_ids`, see `_plan_changes`.
+        """
+        log.info("Syncing changes")
 
-        Webling API doesn't allow filtering on a fixed set of members, e.g. "/members/440,512?filter=...". 
-        Therefore this requires manual checking whether the member has the correct membergroups and a Discord-ID. A positive check results in the bot granting them the member role, otherwise it is removed.
+        async with self.bot.jobs.lock:
+            plan = await self._plan_changes(member_ids)
+            results = await self._apply_plan(plan, priority)
+        return self._make_changes_results(plan, results)
 
-        This uses many seperate API calls to fetch discord ids from webling members. If many members have changed, use `sync all` instead.
+    async def _sync_notified_changes(self, member_ids: set[int]):
         """
-        print("Syncing changes")
+        Syncs changes right after Webling or a relay notified the `ChangeReceiver` about them.
 
-        new = []
-        removed = []
-        not_found = []
-        forbidden : list[str] = []
+        The notified members are fetched again together with the members the changes feed reports, so they are synced even if the feed doesn't list them yet. If the API budget is spent, the next scheduled sync picks the changes up.
+        """
+        self.webling_cache.invalidate('member', member_ids)
+        await self._wait_resumed()
+        if not self.schedule.has_budget():
+            log.warning(f"Webling API budget is spent, leaving {len(member_ids)} notified changes to the scheduled sync.")
+            return
+        log.info(f"Notified about {len(member_ids)} changed members.")
+
+        results = await self._sync_changes(member_ids=member_ids)
+        self._save_results(results)
+
+    async def _sync_resigned(self, priority: int = BULK):
+        """
+        Syncs the roles of resigned members, which are fetched with one bulk request, see `_get_resigned_members`.
+
+        They keep only the roles mapped to their membergroups, usually none. Members handled by an earlier run are skipped until they leave the resigned membergroup.
+        """
+        log.info("Syncing resigned members")
+        await self.bot.member_cache.wait()
+
+        async with self.bot.jobs.lock:
+            guild : discord.Guild = self.bot.guild
+            roles = self._get_mapped_roles(guild)
+
+            with metrics.timer('sync_stage_seconds', kind="resigned", stage="refresh"):
+                resigned_members = [member for member in await self._get_resigned_members() if member.discord_id is not None]
+            start = time.perf_counter()
+            # members that left the membergroup are handled again if they resign again
+            self.resigned_handled &= {member.discord_id for member in resigned_members}
+
+            # maps discord user ids of resigned members to the user and their member id
+            users : dict[int, tuple[discord.Member, int]] = {}
+            targets : dict[int, set[int]] = {}
+            for member in resigned_members:
+                if member.discord_id in self.resigned_handled:
+                    continue
+                user = guild.get_member(member.discord_id)
+                if user is None:
+                    # not on the server, nothing to remove
+                    self.resigned_handled.add(member.discord_id)
+                    continue
+                users[user.id] = (user, member.id)
+                targets.setdefault(user.id, set()).update(self._get_target_role_ids(member))
+
+            operations, old = self._plan_operations(roles, users, targets)
+            metrics.observe('sync_stage_seconds', time.perf_counter() - start, kind="resigned", stage="reconcile")
+            # resigned members are synced without touching the mirror
+            plan = self.SyncPlan("resigned", self.mirror.revision, operations, old, [], [])
+            results = await self._apply_plan(plan, priority)
+
+        # retry transient errors and superseded changes with the next run
+        self.resigned_handled |= users.keys() - {o.member.id for o in results.failed + results.superseded}
+        self._save_resigned_handled()
+        return self._make_changes_results(plan, results)
+
+    async def _plan_all(self):
+        """
+        Plans a full sync: everyone gets exactly the mapped roles of their membergroups, everyone else loses them.
+
+        Only changes since the last sync are fetched from Webling, see `_refresh_mirror`.
+        """
+        # role members are only complete once the member cache is
+        await self.bot.member_cache.wait()
 
-        # fetch current members of role
         guild : discord.Guild = self.bot.guild
-        role = guild.get_role(self.discord_member_role_id)
-        current_role_users = role.members
+        roles = self._get_mapped_roles(guild)
+
+        # maps discord user ids to the user and their member id, everyone with a mapped role is reconciled
+        users : dict[int, tuple[discord.Member, str]] = {}
+        for role in roles.values():
+            for user in role.members:
+                users[user.id] = (user, None)
+        self.member_index.build(guild)
+        
+        # get all eligible members
+        with metrics.timer('sync_stage_seconds', kind="all", stage="refresh"):
+            await self._refresh_mirror()
+        start = time.perf_counter()
+        eligible_members = self.mirror.eligible_members(self.mapped_membergroups)
+
+        if not eligible_members:
+            raise self.NoEligibleMembers()
+
+        not_found : list[str] = []
+        # maps discord user ids to the ids of the roles they should have
+        targets : dict[int, set[int]] = {}
+
+        for member in eligible_members:
+            # TODO: these properties should be envs
+            member_id = member.member_number
+            
+            try:
+                user = self._get_user_by_member(member)
+            except self.UserNotFound:
+                # if that failes, add to not_found
+                log.warning(f"Discord user of member {member_id} not found.")
+                not_found.append(member_id)
+            else:   # user found
+                users[user.id] = (user, member_id)
+                targets.setdefault(user.id, set()).update(self._get_target_role_ids(member))
+
+        operations, old = self._plan_operations(roles, users, targets)
+
+        metrics.observe('sync_stage_seconds', time.perf_counter() - start, kind="all", stage="reconcile")
+        # everyone is synced by this plan
+        return self.SyncPlan("all", self.mirror.revision, operations, old, not_found, None)
+
+    async def _plan_changes(self, member_ids: set[int] = frozenset()):
+        """
+        Plans a sync of the members that changed since the last sync, and of the members with `member_ids`.
 
-        # fetch changed members
-        changed_member_ids = await self._get_changed_members()
+        Changed members may have gained or lost eligibility, so they are fetched without the eligibility filter. 
+        Therefore this requires manual checking which mapped membergroups the member is in and whether they have a Discord-ID. They are granted the roles of their membergroups and lose all other mapped roles.
 
-        if changed_member_ids is None:
-            return self.SyncChangesResults(new, removed)
+        Changed members are read from the mirror, see `_refresh_mirror`. Members that are still dirty from an interrupted sync are synced as well.
+        """
+        # role members are only complete once the member cache is
+        await self.bot.member_cache.wait()
+
+        not_found = []
+
+        guild : discord.Guild = self.bot.guild
+        roles = self._get_mapped_roles(guild)
+        self.member_index.build(guild)
+
+        # update mirror and fetch members that changed since the last sync
+        with metrics.timer('sync_stage_seconds', kind="changes", stage="refresh"):
+            await self._refresh_mirror(member_ids)
+        start = time.perf_counter()
+        changed_members = self.mirror.dirty_members()
         
-        print(f"Fetched {len(changed_member_ids)} changed members")
+        log.info(f"Fetched {len(changed_members)} changed members")
 
-        for member_id in changed_member_ids:
-            member = await self._get_member_by_id(member_id)
+        # maps discord user ids of changed members to the user and their member id, only they are reconciled
+        changed_users : dict[int, tuple[discord.Member, int]] = {}
+        targets : dict[int, set[int]] = {}
 
-            if member is None:
-                print(f"Member {member_id} not found.")
-                continue
+        for member in changed_members:
+            member_id = member.id
             
             try:
                 user = self._get_user_by_member(member)
             except self.UserNotFound:
-                print(f"User {member_id} not found.")
+                log.warning(f"User {member_id} not found.")
                 not_found.append(member_id)
                 continue
             
-            if self._check_eligibility_of_member(member):
-                # user is eligible, try to add role
-
-                # check if user already has role
-                if user not in current_role_users:
-                    # if not, try to add role
-                    try:
-                        await user.add_roles(role)
-                    except discord.errors.Forbidden:
-                        # if that fails, add to failed members
-                        forbidden.append(user.name)
-                    else:
-                        new.append(member_id)
+            changed_users[user.id] = (user, member_id)
+            targets.setdefault(user.id, set()).update(self._get_target_role_ids(member))
+
+        operations, old = self._plan_operations(roles, changed_users, targets)
+
+        member_ids = [member.id for member in changed_members]
+        metrics.observe('sync_stage_seconds', time.perf_counter() - start, kind="changes", stage="reconcile")
+        return self.SyncPlan("changes", self.mirror.revision, operations, old, not_found, member_ids)
+
+    def _plan_operations(self, roles: dict[int, discord.Role], users: dict[int, tuple[discord.Member, object]], targets: dict[int, set[int]]) -> tuple[list[RoleOperation | RoleEdit], list[str]]:
+        """
+        Plans the changes that give each of `users` exactly the mapped `roles` in their `targets`.
+
+        Every user is changed with a single operation, users whose mapped roles already match are skipped. Returns the operations and the names of the users that keep the member role.
+        """
+        added : dict[int, list[discord.Role]] = {}
+        removed : dict[int, list[discord.Role]] = {}
+        unchanged : list[str] = []
+        for role_id, role in roles.items():
+            target_ids = (user_id for user_id in users if role_id in targets.get(user_id, ()))
+            current_ids = (user_id for user_id, (user, _) in users.items() if user.get_role(role_id) is not None)
+            diff = reconcile(target_ids, current_ids)
+            for user_id in diff.to_add:
+                added.setdefault(user_id, []).append(role)
+            for user_id in diff.to_remove:
+                removed.setdefault(user_id, []).append(role)
+            if role_id == self.discord_member_role_id:
+                unchanged = [users[user_id][0].name for user_id in diff.unchanged]
+
+        operations = []
+        for user_id in dict.fromkeys([*added, *removed]):
+            user, ref = users[user_id]
+            operations.append(role_change(user, added.get(user_id, []), removed.get(user_id, []), ref))
+        return operations, unchanged
+
+    def _get_mapped_roles(self, guild: discord.Guild) -> dict[int, discord.Role]:
+        """ Mapped roles by id. Raises `RoleNotFound` if the member role doesn't exist, other missing roles are skipped. """
+        roles = {}
+        for role_id in self.role_mapping:
+            role = guild.get_role(role_id)
+            if role is not None:
+                roles[role_id] = role
+            elif role_id == self.discord_member_role_id:
+                raise self.RoleNotFound()
             else:
-                # user is not eligible, try to remove role
-                try:
-                    await user.remove_roles(role)
-                except discord.errors.Forbidden:
-                    # if that fails, add to failed members
-                    forbidden.append(user.name)
-                else:
-                    removed.append(member_id)
-
-        # set last sync time
-        self.last_sync = int(time.time())
+                log.warning(f"Mapped role {role_id} not found.")
+        return roles
 
-        
-        return self.SyncChangesResults(new, removed, not_found, forbidden)
-        
+    def _get_target_role_ids(self, member: WeblingMember) -> set[int]:
+        """ Ids of the mapped roles of the membergroups of `member`. """
+        return {role_id for role_id, membergroups in self.role_mapping.items() if member.in_groups(membergroups)}
+
+    async def _apply_plan(self, plan, priority: int = BULK) -> RoleResults:
+        """
+        Executes the role changes of `plan` and marks its members as synced.
+
+        The changes run as checkpointed job, so they are resumed after a restart, see `_resume_sync`. The caller has to hold the job lock.
+        """
+        meta = {'kind': plan.kind, 'member_ids': plan.member_ids}
+        with metrics.timer('sync_stage_seconds', kind=plan.kind, stage="apply"):
+            results = await self.bot.jobs.run(JOB_KIND, plan.operations, self._make_role_executor(f"Sync {plan.kind}", priority), meta)
+        self._mark_synced(plan.member_ids, results)
+        return results
+
+    async def _resume_sync(self):
+        """ Finishes a sync job that was interrupted by a restart. """
+        await self.bot.member_cache.wait()
+        async with self.bot.jobs.lock:
+            resumed = await self.bot.jobs.resume(JOB_KIND, self.bot.guild, self._make_role_executor("Resumed sync", BACKGROUND))
+            if resumed is None:
+                return
+            meta, results = resumed
+            self._mark_synced(meta['member_ids'], results)
+        log.info(f"Resumed sync {meta['kind']}: {len(results.added)} added, {len(results.removed)} removed")
+
+    def _mark_synced(self, member_ids: list[int], results: RoleResults):
+        """ Marks the members with `member_ids` as synced, all if None, except those whose change was superseded and never ran. """
+        self.mirror.mark_clean(member_ids)
+        superseded = [self.mirror.find_by_discord(o.member.id, o.member.name) for o in results.superseded]
+        self.mirror.mark_dirty([member.id for member in superseded if member is not None])
+
+    async def _wait_resumed(self):
+        """
+        Waits until an interrupted sync job was resumed.
+
+        Starting a new job replaces the unfinished one, so automatic syncs have to wait for `_resume_sync`, which in turn waits for the member cache.
+        """
+        await self.bot.member_cache.wait()
+        if self._resume_task is not None:
+            # a failed resume must not stop the syncs
+            await asyncio.wait({self._resume_task})
+
+    async def _grant_on_join(self, member: discord.Member):
+        """
+        Grants the mapped roles to a joining user right away, if the mirror links them to a Webling member.
+
+        Users that aren't linked yet are picked up by the next sync once their Webling member changes. If granting fails, the Webling member is flagged dirty, so the next `sync changes` retries it.
+        """
+        if self.mirror.revision is None:
+            # never synced, nothing to look up
+            return
+        webling_member = self.mirror.find_by_discord(member.id, member.name)
+        if webling_member is None:
+            metrics.inc('join_grants_total', status="skipped")
+            return
 
-    def _check_eligibility_of_member(self, member: object) -> bool:
-        """ Checks if member is in at least one eligible membergroup. """
-        membergroups = list(map(int, member['parents']))
-        return bool([i for i in membergroups if i in self.valid_membergroups])
+        try:
+            roles = self._get_mapped_roles(member.guild)
+        except self.RoleNotFound:
+            return
+        add = [roles[role_id] for role_id in self._get_target_role_ids(webling_member) if role_id in roles and member.get_role(role_id) is None]
+        if not add:
+            metrics.inc('join_grants_total', status="skipped")
+            return
+        operation = role_change(member, add, [])
+        try:
+            await self.bot.writes.submit(lambda: operation.apply(reason="Webling member joined"), operation.bucket, INTERACTIVE, operation.keys)
+        except Superseded:
+            # a newer change of the same roles decides
+            return
+        except discord.HTTPException as e:
+            log.warning(f"Granting roles to {member} on join failed: {e}")
+            metrics.inc('join_grants_total', status="failed")
+            self.mirror.mark_dirty([webling_member.id])
+        else:
+            log.info(f"Granted {len(add)} roles to {member} (member {webling_member.member_number}) on join.")
+            metrics.inc('join_grants_total', status="done")
+
+    def _make_changes_results(self, plan, results: RoleResults):
+        new = [o.ref for o in results.added]
+        removed = [o.ref for o in results.removed]
+        forbidden = [o.member.name for o in results.forbidden + results.failed]
+        return self.SyncChangesResults(new, removed, plan.not_found, forbidden)
+
+    def _make_role_executor(self, label: str, priority: int = BULK) -> RoleExecutor:
+        return RoleExecutor(workers=self.role_workers, reason=label, progress=log_progress(label), scheduler=self.bot.writes, priority=priority)
 
-    def _get_user_by_member(self, member: object) -> discord.Member:
+    def _get_user_by_member(self, member: WeblingMember) -> discord.Member:
         """
         Fetch discord user of a given member.
         Tries to fetch by user id first, then by username. 
@@ -305,125 +793,125 @@ class WeblingSync(commands.Cog):
         guild : discord.Guild = self.bot.guild
         user = None
         # try to fetch user by ID
-        user_id = member['properties']['Discord-ID']
-        if user_id:
-            try:
-                user_id = int(user_id)
-            except ValueError:
-                pass
-            else:
-                user = guild.get_member(user_id)
-        if user is None:
+        if member.discord_id is not None:
+            user = guild.get_member(member.discord_id)
+            if user is not None:
+                metrics.inc('member_lookups_total', method="id")
+                return user
+        if member.discord_name is not None:
             # if it fails, try to fetch by name
-            user_name = member['properties']['Discord-Benutzername']
-            if user_name:
-                user_name = str(user_name)
-                all_users = guild.members
-                user = next((u for u in all_users if u.name == user_name), None)
-        if user is None:
-            raise self.UserNotFound()
-        else:
-            return user
+            user = self.member_index.get(member.discord_name)
+            if user is not None:
+                metrics.inc('member_lookups_total', method="name")
+                return user
+        metrics.inc('member_lookups_total', method="miss")
+        raise self.UserNotFound()
+
+    async def _refresh_mirror(self, member_ids: set[int] = frozenset()) -> None:
+        """
+        Brings the member mirror up to date with Webling.
 
-    async def _get_eligible_members(self) -> list[object]:
+        The first refresh downloads every member with a Discord-ID or username. Afterwards only members reported by the changes feed and the members with `member_ids` are fetched, in chunks of `WEBLING_CHUNK_SIZE` ids. If Webling can't provide changes since the stored revision anymore, the mirror is seeded again.
         """
-        This makes one big API call to Webling and prefilters for members that have the correct membergroups and a Discord-ID. Which is a lot faster than calling each member individually.
+        revision = self.mirror.revision
+        if revision is not None:
+            changes = await self._get_changes(revision)
+            new_revision = int(changes.get('revision', -1))
+            if new_revision >= 0:
+                # notified members may not be in the feed yet
+                changed_member_ids = list(dict.fromkeys([*self._get_object_ids(changes.get('objects'), 'member'), *map(int, member_ids)]))
+                deleted_member_ids = self._get_object_ids(changes.get('deleted'), 'member')
+                members = await self._get_members_by_ids(changed_member_ids)
+                # members that vanished in the meantime are treated as deleted
+                deleted_member_ids.extend(i for i in changed_member_ids if i not in members)
+                metrics.inc('webling_changed_members_total', len(members) + len(deleted_member_ids))
+                self.mirror.apply_changes(list(map(WeblingMember.parse, members.values())), deleted_member_ids, new_revision)
+                log.info(f"Mirror updated to revision {new_revision}: {len(members)} changed, {len(deleted_member_ids)} deleted")
+                return
+
+        # never synced or revision too old
+        new_revision = await self._get_revision()
+        members = [member async for member in self._get_linked_members()]
+        self.mirror.seed(members, new_revision)
+        log.info(f"Mirror seeded at revision {new_revision} with {len(members)} members")
+
+    async def _get_linked_members(self):
         """
-        request = f"{self.api_url}/member?filter=$parents.$id IN {str(self.valid_membergroups)} AND (NOT `Discord-ID` IS EMPTY OR NOT `Discord-Benutzername` IS EMPTY)&format=full"
-        response = requests.get(request, headers=self.api_header)
+        This makes one big API call to Webling and prefilters for members that have a Discord-ID or username. Which is a lot faster than calling each member individually.
 
-        if response.status_code != 200:
-            # TODO: this should be a custom exception
-            raise RuntimeError(f'Request failed with status code {response.status_code}')
-        
-        members = response.json()
-        
-        # check if members is iterable
-        try:
-            iter(members)
-        except TypeError:
-            return None
-
-        return members
+        The response is parsed while it is downloaded and only the fields the sync needs are kept of each member.
+        """
+        params = {
+            'filter': "NOT `Discord-ID` IS EMPTY OR NOT `Discord-Benutzername` IS EMPTY",
+            'format': 'full',
+        }
+        async for member in self.webling.stream("/member", params=params):
+            yield WeblingMember.parse(member)
     
-    async def _get_resigned_members(self) -> list[int]:
+    async def _get_resigned_members(self) -> list[WeblingMember]:
         """
-        Gets Discord-IDs of members that have resigned.
+        Gets members that have resigned.
 
         This makes one big API call to Webling and prefilters for members that have the correct membergroup and a Discord-ID. Which is a lot faster than calling each member individually.
         """
-        request = f"{self.api_url}/member?filter=$parents.$id = {self.resigned_membergroup_id} AND NOT `Discord-ID` IS EMPTY&format=full"
-        response = requests.get(request, headers=self.api_header)
-
-        if response.status_code != 200:
-            # TODO: this should be a custom exception
-            raise RuntimeError(f'Request failed with status code {response.status_code}')
-        
-        data = response.json()
-        
-        # TODO: check if data is iterable
-
-        discord_ids = []
-        for member in data:
-            discord_id = int(member['properties']['Discord-ID'])
-            discord_ids.append(discord_id)
-        return discord_ids
+        params = {
+            'filter': f"$parents.$id = {self.resigned_membergroup_id} AND NOT `Discord-ID` IS EMPTY",
+            'format': 'full',
+        }
+        return [WeblingMember.parse(member) async for member in self.webling.stream("/member", params=params)]
     
-    async def _get_member_by_id(self, member_id) -> object:
-        request = self.api_url + "/member/" + str(member_id)
-        response = requests.get(request, headers=self.api_header)
-
-        if response.status_code != 200:
-            raise RuntimeError(f'Request failed with status code {response.status_code}')
-        else:
-            data = response.json()
-            return data
-
-    async def _get_club_members(self) -> list[int]:
-        request = self.api_url + "/membergroup/" + self.membergroup_id
-        response = requests.get(request, headers=self.api_header)
-
-        if response.status_code != 200:
-            print(f'Request failed with status code {response.status_code}')
-        else:
-            data = response.json()
-            return data['children']['member']
-        
-    async def _get_discord_id_of_member(self, member_id) -> int:
-        request = self.api_url + "/member/" + str(member_id)
-        response = requests.get(request, headers=self.api_header)
-
-        if response.status_code != 200:
-            raise RuntimeError(f'Request failed with status code {response.status_code}')
-        else:
-            data = response.json()
-            return data['properties']['Discord-ID']
-            
-    async def _get_changes(self) -> object:
-        request = self.api_url + "/changes/" + str(self.last_sync)
-
-        response = requests.get(request, headers=self.api_header)
-
-        if response.status_code != 200:
-            raise RuntimeError(f'Request failed with status code {response.status_code}')
-        else:
-            data = response.json()
-            return data
+    async def _get_members_by_ids(self, member_ids: list[int]) -> dict[int, object]:
+        """ Fetches many members at once, see `WeblingCache.get_many`. """
+        return await self.webling_cache.get_many("member", member_ids, chunk_size=self.chunk_size)
+
+    async def _get_changes(self, revision: int) -> object:
+        # the feed changes over time and is never cached, but evicts the changed members
+        changes = await self.webling.get("/changes/" + str(revision))
+        self.webling_cache.invalidate_changes(changes)
+        return changes
+
+    async def _get_revision(self) -> int:
+        data = await self.webling.get("/replicate")
+        return int(data['revision'])
     
-    async def _get_changed_members(self) -> list[int]:
-        changes = await self._get_changes()
+    @staticmethod
+    def _get_object_ids(objects: object, object_type: str) -> list[int]:
+        """ Extracts ids of `object_type` from the objects of a changes response. """
         try:
-            changed_member_ids = changes['objects']['member']
-        except TypeError:
-            # no new members
-            return None
+            ids = objects[object_type]
+        except (TypeError, KeyError):
+            # webling sends an empty list if nothing changed
+            return []
         else:
             # cast to list of integers
-            return list(map(int, changed_member_ids))
+            return list(map(int, ids))
 
     class UserNotFound(Exception):
         """Raise when discord user could not be fetched"""
 
+    class RoleNotFound(Exception):
+        """Raise when the member role doesn't exist"""
+
+    class NoEligibleMembers(Exception):
+        """Raise when Webling has no eligible members at all"""
+
+    class SyncPlan():
+        """ Role changes a sync would make, computed without touching any roles. """
+        def __init__(self, kind : str, revision : int, operations : list[RoleOperation], unchanged : list[str], not_found : list, member_ids : list[int] = None):
+            self.kind = kind
+            # mirror revision the plan was computed on
+            self.revision = revision
+            self.operations = operations
+            self.unchanged = unchanged
+            self.not_found = not_found
+            # members of the mirror that are synced by the plan, None for all
+            self.member_ids = member_ids
+            self.time = time.time()
+
+        def estimate_duration(self) -> float:
+            """ Rough estimate of how many seconds applying the plan takes. """
+            return len(self.operations) / ROLE_CHANGES_PER_SECOND
+
     class SyncChangesResults():
         def __init__(self, new : list[int], removed : list[int], not_found : list[int] = [], forbidden : list[str] = []):
             self.new = new
@@ -431,23 +919,37 @@ class WeblingSync(commands.Cog):
             self.not_found = not_found
             self.forbidden = forbidden
             self.time = time.time()
+
+        def to_dict(self) -> dict:
+            return {
+                'new': self.new,
+                'removed': self.removed,
+                'not_found': self.not_found,
+                'forbidden': self.forbidden,
+                'time': self.time,
+            }
+
+        @classmethod
+        def from_dict(cls, data: dict):
+            results = cls(data['new'], data['removed'], data['not_found'], data['forbidden'])
+            results.time = data['time']
+            return results
         
-        def make_embed(self):
+        def make_report(self) -> Report:
             # sent sync report
-            embed = discord.Embed(title="Sync Report", color=0x009260)
-            embed.add_field(name=f"Last Sync: {time.ctime(self.time)}", inline=True)
-            embed.add_field(name=f"New Member IDs ({len(self.new)})", value=f"{', '.join(list(map(str, self.new)))}")
-            embed.add_field(name=f"Removed Member IDs ({len(self.removed)})", value=f"{', '.join(list(map(str, self.removed)))}")
+            report = Report("Sync Report", 0x009260, f"Last Sync: {time.ctime(self.time)}")
+            report.add_list(f"New Member IDs ({len(self.new)})", self.new)
+            report.add_list(f"Removed Member IDs ({len(self.removed)})", self.removed)
             if len(self.not_found) > 0:
-                embed.add_field(name=f"Member IDs with unmatched discord references ({len(self.not_found)})", value=f"{', '.join(list(map(str, self.not_found)))}", inline=True)
+                report.add_list(f"Member IDs with unmatched discord references ({len(self.not_found)})", self.not_found)
             
             if len(self.forbidden) > 0:
-                embed.add_field(name=f"Discord users that could not be modified ({len(self.forbidden)})", value=f"{', '.join(list(map(str, self.forbidden)))}", inline=True)
+                report.add_list(f"Discord users that could not be modified ({len(self.forbidden)})", self.forbidden)
 
-            return embed
+            return report
 
 async def setup(bot):
     await bot.add_cog(WeblingSync(bot))
 
 async def teardown(bot):
-    print("Extension unloaded!")
\ No newline at end of file
+    log.info("Extension unloaded!")
\ No newline at end of file
@@ -0,0 +1,153 @@
+import logging
+import asyncio
+import json
+import pathlib
+import sqlite3
+import time
+import discord
+from utils.roles import EDIT, RoleEdit, RoleExecutor, RoleOperation, RoleOutcome, RoleResults
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    kind TEXT PRIMARY KEY,
+    meta TEXT
+);
+CREATE TABLE IF NOT EXISTS job_operation (
+    kind TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    ref TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    role_ids TEXT,
+    PRIMARY KEY (kind, idx)
+);
+"""
+
+
+class JobQueue():
+    """
+    Persistent queue of the role operations of long running jobs.
+
+    Every job kind has at most one job, whose operations are checkpointed as they complete. Checkpoints are written in batches of `checkpoint_size` operations or every `checkpoint_interval` seconds, so the event loop doesn't wait for a disk sync per operation. If the bot stops halfway through, `resume` runs the remaining operations after the restart; operations of an unwritten batch run again, which doesn't change anything.
+
+    `lock` has to be held while planning or running a job, so bulk jobs of all cogs never overlap.
+    """
+    def __init__(self, path: str, checkpoint_size: int = 100, checkpoint_interval: float = 1.0):
+        self.path = pathlib.Path(path)
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = asyncio.Lock()
+        self._db : sqlite3.Connection = None
+        # indices of completed operations that aren't written yet
+        self._done : list[int] = []
+        self._last_checkpoint = 0.0
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(job_operation)")}
+        if 'role_ids' not in columns:
+            # added for role edits
+            self._db.execute("ALTER TABLE job_operation ADD COLUMN role_ids TEXT")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def run(self, kind: str, operations: list[RoleOperation | RoleEdit], executor: RoleExecutor, meta: object = None) -> RoleResults:
+        """ Runs `operations` as the new job of `kind`, replacing any unfinished one. `meta` is stored with the job. """
+        operations = list(operations)
+        self._start(kind, operations, meta)
+        try:
+            results = await executor.run(operations, on_outcome=lambda index, outcome: self._complete(kind, index, outcome))
+        finally:
+            self._checkpoint(kind)
+        self._finish(kind)
+        return results
+
+    async def resume(self, kind: str, guild: discord.Guild, executor: RoleExecutor) -> tuple[object, RoleResults]:
+        """ Runs the remaining operations of an unfinished job of `kind`. Returns its meta and results, or None if there is none. """
+        row = self._db.execute("SELECT meta FROM job WHERE kind = ?", (kind,)).fetchone()
+        if row is None:
+            return None
+        meta = json.loads(row[0])
+
+        operations = []
+        indices = []
+        rows = self._db.execute("SELECT idx, user_id, role_id, action, ref, role_ids FROM job_operation WHERE kind = ? AND done = 0 ORDER BY idx", (kind,))
+        for index, user_id, role_id, action, ref, role_ids in rows.fetchall():
+            member = guild.get_member(user_id)
+            if member is None:
+                # member left in the meantime
+                continue
+            if action == EDIT:
+                add_ids, remove_ids = json.loads(role_ids)
+                # roles that were deleted in the meantime are skipped
+                add = [role for role in map(guild.get_role, add_ids) if role is not None]
+                remove = [role for role in map(guild.get_role, remove_ids) if role is not None]
+                if not add and not remove:
+                    continue
+                operations.append(RoleEdit(member, add, remove, json.loads(ref)))
+            else:
+                role = guild.get_role(role_id)
+                if role is None:
+                    continue
+                operations.append(RoleOperation(member, role, action, json.loads(ref)))
+            indices.append(index)
+
+        log.info(f"Resuming {kind} job with {len(operations)} remaining operations")
+        self._done.clear()
+        self._last_checkpoint = time.monotonic()
+        try:
+            results = await executor.run(operations, on_outcome=lambda index, outcome: self._complete(kind, indices[index], outcome))
+        finally:
+            self._checkpoint(kind)
+        self._finish(kind)
+        return meta, results
+
+    def _start(self, kind: str, operations: list[RoleOperation | RoleEdit], meta: object):
+        with self._db:
+            self._db.execute("DELETE FROM job_operation WHERE kind = ?", (kind,))
+            self._db.execute("INSERT OR REPLACE INTO job (kind, meta) VALUES (?, ?)", (kind, json.dumps(meta)))
+            self._db.executemany(
+                "INSERT INTO job_operation (kind, idx, user_id, role_id, action, ref, role_ids) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._row(kind, index, o) for index, o in enumerate(operations)),
+            )
+        self._done.clear()
+        self._last_checkpoint = time.monotonic()
+
+    @staticmethod
+    def _row(kind: str, index: int, operation: RoleOperation | RoleEdit) -> tuple:
+        if operation.action == EDIT:
+            # edits change several roles, which are stored as JSON instead
+            role_ids = json.dumps(([role.id for role in operation.add], [role.id for role in operation.remove]))
+            return (kind, index, operation.member.id, 0, operation.action, json.dumps(operation.ref), role_ids)
+        return (kind, index, operation.member.id, operation.role.id, operation.action, json.dumps(operation.ref), None)
+
+    def _complete(self, kind: str, index: int, outcome: RoleOutcome):
+        if outcome.status == RoleOutcome.SUPERSEDED:
+            # never ran, so it runs again if the job is resumed
+            return
+        self._done.append(index)
+        if len(self._done) >= self.checkpoint_size or time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self._checkpoint(kind)
+
+    def _checkpoint(self, kind: str):
+        """ Writes the completed operations of the running job in one transaction. """
+        self._last_checkpoint = time.monotonic()
+        if not self._done:
+            return
+        with self._db:
+            self._db.executemany("UPDATE job_operation SET done = 1 WHERE kind = ? AND idx = ?", ((kind, index) for index in self._done))
+        self._done.clear()
+
+    def _finish(self, kind: str):
+        with self._db:
+            self._db.execute("DELETE FROM job_operation WHERE kind = ?", (kind,))
+            self._db.execute("DELETE FROM job WHERE kind = ?", (kind,))
@@ -0,0 +1,122 @@
+import logging
+import asyncio
+import time
+import discord
+from utils.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class MemberIndex():
+    """
+    Index of guild members by username for constant-time lookups.
+
+    Usernames are matched exactly first, then case-insensitively. Global names are never matched, as anyone can set them to the username of someone else.
+    """
+    def __init__(self):
+        self._names : dict[str, discord.Member] = {}
+        self._lower_names : dict[str, discord.Member] = {}
+
+    def build(self, guild: discord.Guild):
+        """ Rebuilds the index from the member cache of `guild`. """
+        self._names.clear()
+        self._lower_names.clear()
+        for member in guild.members:
+            self.add(member)
+
+    def add(self, member: discord.Member):
+        self._names[member.name] = member
+        self._lower_names[member.name.lower()] = member
+
+    def remove(self, member: discord.Member):
+        if getattr(self._names.get(member.name), 'id', None) == member.id:
+            del self._names[member.name]
+        lower_name = member.name.lower()
+        if getattr(self._lower_names.get(lower_name), 'id', None) == member.id:
+            del self._lower_names[lower_name]
+
+    def update(self, before: discord.User, after: discord.Member):
+        """
+        Re-indexes `after` under its new username.
+
+        `before` has to be a copy of the old user as passed to `on_user_update`. The members of `on_member_update` share one user object, so their names are always the same.
+        """
+        if before.name != after.name:
+            self.remove(before)
+        self.add(after)
+
+    def get(self, name: str) -> discord.Member:
+        """ Returns the member known by `name` or None. """
+        member = self._names.get(name)
+        if member is not None:
+            return member
+        return self._lower_names.get(name.lower())
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class MemberCache():
+    """
+    Readiness gate for the member cache of the bot's guild.
+
+    Syncs must not run on a partially chunked guild, as every member that isn't cached yet would look like it lost its role. `start` chunks the guild in the background and everything that relies on `guild.members` awaits `wait` first.
+    """
+    def __init__(self, progress_interval: float = 5.0):
+        self.guild : discord.Guild = None
+        self.progress_interval = progress_interval
+        self._ready = asyncio.Event()
+        self._task : asyncio.Task = None
+
+    @property
+    def progress(self) -> tuple[int, int]:
+        """ Number of cached members and total number of members of the guild. """
+        if self.guild is None:
+            return (0, 0)
+        return (len(self.guild.members), self.guild.member_count or 0)
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self, guild: discord.Guild):
+        """
+        Starts loading the members of `guild` unless they are loaded or loading already.
+
+        A reconnect with a new session replaces every guild object, which isn't chunked yet with lazy chunking. So the cache isn't ready anymore until a new or unchunked guild is loaded again.
+        """
+        loading = self._task is not None and not self._task.done()
+        if guild is self.guild and (loading or (self.is_ready() and guild.chunked)):
+            return
+        if loading:
+            self._task.cancel()
+        self.guild = guild
+        self._ready.clear()
+        self._task = asyncio.create_task(self._load(guild))
+
+    async def wait(self, timeout: float = None) -> bool:
+        """ Waits until the member cache is complete. Returns False if it wasn't within `timeout` seconds. """
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            metrics.observe('member_cache_wait_seconds', time.perf_counter() - start)
+        return True
+
+    async def _load(self, guild: discord.Guild):
+        if not guild.chunked:
+            log.info(f"Chunking members of {guild.name}")
+            reporter = asyncio.create_task(self._report_progress())
+            try:
+                await guild.chunk(cache=True)
+            finally:
+                reporter.cancel()
+        log.info(f"Member cache of {guild.name} is ready ({len(guild.members)} members)")
+        self._ready.set()
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            loaded, total = self.progress
+            log.info(f"Chunking members: {loaded}/{total}")
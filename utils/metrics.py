@@ -0,0 +1,146 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from aiohttp import web
+from utils.storage import write_text
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds, from fast cache hits to slow bulk requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram():
+    """ Cumulative-bucket histogram in the style of Prometheus. """
+    def __init__(self, buckets: tuple[float] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket containing the `q` quantile. """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics():
+    """
+    Registry of counters and histograms, keyed by name and labels.
+
+    Everything is kept in memory and can be rendered in the Prometheus text format.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters : dict[tuple, float] = {}
+        self.histograms : dict[tuple, Histogram] = {}
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """ Observes the time spent in the `with` block, including awaits. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        """ Sum of all counters of `name` whose labels include `labels`. """
+        return sum(
+            value for (counter_name, counter_labels), value in self.counters.items()
+            if counter_name == name and set(labels.items()) <= set(counter_labels)
+        )
+
+    def select(self, name: str) -> list[tuple[dict, Histogram]]:
+        """ All histograms of `name` with their labels. """
+        return [(dict(labels), histogram) for (histogram_name, labels), histogram in self.histograms.items() if histogram_name == name]
+
+    def render(self) -> str:
+        """ Renders all metrics in the Prometheus text exposition format. """
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+# registry shared by the whole bot
+metrics = Metrics()
+
+
+class MetricsExporter():
+    """
+    Exposes `metrics` locally, on an HTTP endpoint on localhost and/or as a text file that is rewritten periodically.
+    """
+    def __init__(self, port: int = None, path: str = None, interval: float = 60.0):
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self._runner : web.AppRunner = None
+        self._task : asyncio.Task = None
+
+    async def start(self):
+        if self.port is not None:
+            app = web.Application()
+            app.router.add_get('/metrics', self._handle)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+            log.info("Serving metrics on http://127.0.0.1:%d/metrics", self.port)
+        if self.path is not None:
+            self._task = asyncio.create_task(self._write_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type='text/plain')
+
+    async def _write_loop(self):
+        while True:
+            write_text(self.path, metrics.render())
+            await asyncio.sleep(self.interval)
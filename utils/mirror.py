@@ -0,0 +1,145 @@
+import pathlib
+import sqlite3
+from utils.webling import WeblingMember
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS member (
+    id INTEGER PRIMARY KEY,
+    member_number TEXT,
+    discord_id TEXT,
+    discord_name TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    dirty INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS member_group (
+    member_id INTEGER NOT NULL,
+    group_id INTEGER NOT NULL,
+    PRIMARY KEY (member_id, group_id)
+);
+CREATE INDEX IF NOT EXISTS member_group_group_id ON member_group (group_id);
+CREATE INDEX IF NOT EXISTS member_discord_id ON member (discord_id);
+CREATE INDEX IF NOT EXISTS member_discord_name ON member (discord_name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SELECT_MEMBERS = """
+SELECT m.id, m.member_number, m.discord_id, m.discord_name, group_concat(g.group_id)
+FROM member m LEFT JOIN member_group g ON g.member_id = m.id
+"""
+
+
+class MemberMirror():
+    """
+    Local SQLite copy of the Webling member fields the sync needs.
+
+    The mirror is seeded once and then only updated from the Webling changes feed. Members that changed since they were last synced are flagged as dirty until `mark_clean` is called, so a restart can pick up where the last sync stopped. Deleted members are kept without membergroups until they are clean, so their role can still be removed.
+    """
+    def __init__(self, path: str):
+        self.path = pathlib.Path(path)
+        self._db : sqlite3.Connection = None
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @property
+    def revision(self) -> int:
+        """ Webling revision the mirror is up to date with or None if it was never seeded. """
+        row = self._db.execute("SELECT value FROM state WHERE key = 'revision'").fetchone()
+        return None if row is None else int(row[0])
+
+    def seed(self, members: list[WeblingMember], revision: int):
+        """ Replaces the mirror with `members`. All of them are dirty afterwards. """
+        with self._db:
+            self._db.execute("DELETE FROM member")
+            self._db.execute("DELETE FROM member_group")
+            self._upsert(members)
+            self._set_revision(revision)
+
+    def apply_changes(self, members: list[WeblingMember], deleted_ids: list[int], revision: int):
+        """ Updates changed members, flags deleted ones and advances the revision. """
+        with self._db:
+            self._upsert(members)
+            for member_id in deleted_ids:
+                self._db.execute("DELETE FROM member_group WHERE member_id = ?", (member_id,))
+                self._db.execute("UPDATE member SET deleted = 1, dirty = 1 WHERE id = ?", (member_id,))
+            self._set_revision(revision)
+
+    def mark_clean(self, member_ids: list[int] = None):
+        """ Marks members as synced, all of them if no ids are given. Synced deleted members are dropped. """
+        with self._db:
+            if member_ids is None:
+                self._db.execute("UPDATE member SET dirty = 0")
+            else:
+                self._db.executemany("UPDATE member SET dirty = 0 WHERE id = ?", ((i,) for i in member_ids))
+            self._db.execute("DELETE FROM member WHERE deleted = 1 AND dirty = 0")
+            self._db.execute("DELETE FROM member_group WHERE member_id NOT IN (SELECT id FROM member)")
+
+    def mark_dirty(self, member_ids: list[int]):
+        """ Flags members to be synced again, e.g. after their role change failed. """
+        with self._db:
+            self._db.executemany("UPDATE member SET dirty = 1 WHERE id = ?", ((i,) for i in member_ids))
+
+    def find_by_discord(self, discord_id: int, name: str) -> WeblingMember:
+        """ Member linked to a Discord user by their ID or else by their username, None if there is none. """
+        members = self._select("WHERE m.deleted = 0 AND m.discord_id = ?", (str(discord_id),))
+        if not members:
+            members = self._select("WHERE m.deleted = 0 AND m.discord_id IS NULL AND m.discord_name = ? COLLATE NOCASE", (name,))
+        return members[0] if members else None
+
+    def dirty_members(self) -> list[WeblingMember]:
+        """ Members that changed since they were last synced. """
+        return self._select("WHERE m.dirty = 1")
+
+    def eligible_members(self, membergroups: frozenset[int]) -> list[WeblingMember]:
+        """ Members in at least one of `membergroups` with a Discord-ID or username. """
+        membergroups = tuple(membergroups)
+        placeholders = ', '.join('?' * len(membergroups))
+        return self._select(
+            f"WHERE m.deleted = 0 AND (m.discord_id IS NOT NULL OR m.discord_name IS NOT NULL) "
+            f"AND m.id IN (SELECT member_id FROM member_group WHERE group_id IN ({placeholders}))",
+            membergroups,
+        )
+
+    def _select(self, where: str, params: tuple = ()) -> list[WeblingMember]:
+        rows = self._db.execute(f"{SELECT_MEMBERS} {where} GROUP BY m.id", params)
+        return [
+            WeblingMember(
+                member_id,
+                member_number,
+                int(discord_id) if discord_id is not None else None,
+                discord_name,
+                frozenset(map(int, groups.split(','))) if groups else frozenset(),
+            )
+            for member_id, member_number, discord_id, discord_name, groups in rows
+        ]
+
+    def _upsert(self, members: list[WeblingMember]):
+        for member in members:
+            self._db.execute(
+                "INSERT OR REPLACE INTO member (id, member_number, discord_id, discord_name, deleted, dirty) VALUES (?, ?, ?, ?, 0, 1)",
+                (
+                    member.id,
+                    member.member_number,
+                    str(member.discord_id) if member.discord_id is not None else None,
+                    member.discord_name,
+                ),
+            )
+            self._db.execute("DELETE FROM member_group WHERE member_id = ?", (member.id,))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO member_group (member_id, group_id) VALUES (?, ?)",
+                ((member.id, group_id) for group_id in member.groups),
+            )
+
+    def _set_revision(self, revision: int):
+        self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('revision', ?)", (str(revision),))
+
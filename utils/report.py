@@ -0,0 +1,123 @@
+import csv
+import io
+import discord
+from discord.ext import commands
+from utils.writes import INTERACTIVE
+
+# Discord's limits for embeds
+FIELD_LIMIT = 1024
+EMBED_LIMIT = 6000
+FIELDS_PER_EMBED = 25
+# room for the page number in the footer
+FOOTER_RESERVE = 32
+SEPARATOR = ", "
+
+
+class Report():
+    """
+    Report of possibly very long lists, rendered as pages of embeds that all stay within Discord's limits.
+
+    Lists are packed into as many fields as they need and the fields into as many pages as they need, so nothing is dropped. Each field is joined from at most 1024 characters, so even huge lists are rendered in one pass. The full lists can also be attached as CSV file.
+    """
+    def __init__(self, title: str, color: int, description: str = None):
+        self.title = title
+        self.color = color
+        self.description = description
+        # name, items, formatter of the items, inline, listed in the CSV file
+        self._sections : list[tuple[str, list, callable, bool, bool]] = []
+
+    def add_field(self, name: str, value: str, inline: bool = True):
+        """ Adds a single field that isn't part of the CSV file. """
+        self._sections.append((name, [value], str, inline, False))
+
+    def add_list(self, name: str, items: list, format: callable = str, inline: bool = True):
+        """ Adds a list of `items`, shown with `format` in the embeds and with `str` in the CSV file. """
+        self._sections.append((name, items, format, inline, True))
+
+    def pages(self) -> list[discord.Embed]:
+        pages = []
+        embed, size = self._new_page()
+        for name, items, format, inline, _ in self._sections:
+            for field_name, value in self._pack(name, items, format):
+                field_size = len(field_name) + len(value)
+                if len(embed.fields) == FIELDS_PER_EMBED or size + field_size > EMBED_LIMIT - FOOTER_RESERVE:
+                    pages.append(embed)
+                    embed, size = self._new_page()
+                embed.add_field(name=field_name, value=value, inline=inline)
+                size += field_size
+        pages.append(embed)
+
+        if len(pages) > 1:
+            for number, page in enumerate(pages, 1):
+                page.set_footer(text=f"Page {number}/{len(pages)}")
+        return pages
+
+    def to_csv(self) -> discord.File:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(("section", "value"))
+        for name, items, _, _, listed in self._sections:
+            if listed:
+                writer.writerows((name, str(item)) for item in items)
+        filename = self.title.lower().replace(' ', '_') + ".csv"
+        return discord.File(io.BytesIO(buffer.getvalue().encode()), filename=filename)
+
+    async def send(self, ctx: commands.Context, content: str = None, attach_csv: bool = False):
+        """ Sends the first page, with buttons to flip through the others if there are more. """
+        pages = self.pages()
+        kwargs = {}
+        if attach_csv:
+            kwargs['file'] = self.to_csv()
+        if len(pages) > 1:
+            kwargs['view'] = ReportView(pages)
+        # replies overtake bulk writes in the scheduler of the bot
+        await ctx.bot.writes.submit(lambda: ctx.send(content, embed=pages[0], **kwargs), ('message', ctx.channel.id), INTERACTIVE)
+
+    def _new_page(self) -> tuple[discord.Embed, int]:
+        embed = discord.Embed(title=self.title, color=self.color, description=self.description)
+        return embed, len(self.title) + len(self.description or '')
+
+    @staticmethod
+    def _pack(name: str, items: list, format: callable):
+        """ Yields the fields of a list, each value as long as Discord allows. """
+        field_name = name
+        chunk = []
+        length = 0
+        for item in items:
+            text = format(item)[:FIELD_LIMIT]
+            added = len(text) + (len(SEPARATOR) if chunk else 0)
+            if length + added > FIELD_LIMIT:
+                yield field_name, SEPARATOR.join(chunk)
+                field_name = f"{name} (cont.)"
+                chunk = []
+                added = len(text)
+                length = 0
+            chunk.append(text)
+            length += added
+        yield field_name, SEPARATOR.join(chunk) if chunk else "None"
+
+
+class ReportView(discord.ui.View):
+    """ Buttons to flip through the pages of a `Report`. """
+    def __init__(self, pages: list[discord.Embed], timeout: float = 15 * 60):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.index = 0
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.index == len(self.pages) - 1
+
+    async def _show(self, interaction: discord.Interaction, index: int):
+        self.index = index
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.pages[index], view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index + 1)
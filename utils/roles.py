@@ -0,0 +1,275 @@
+import logging
+import asyncio
+import random
+import discord
+from collections.abc import Iterable
+from utils.metrics import metrics
+from utils.writes import BULK, Superseded, WriteScheduler
+
+log = logging.getLogger(__name__)
+
+ADD = "add"
+REMOVE = "remove"
+EDIT = "edit"
+
+
+class RoleOperation():
+    """ A planned role change of a single member. `ref` can be used by the caller to carry its own reference, e.g. a Webling member id. """
+    def __init__(self, member: discord.Member, role: discord.Role, action: str, ref=None):
+        self.member = member
+        self.role = role
+        self.action = action
+        self.ref = ref
+
+    @property
+    def bucket(self) -> tuple:
+        # Discord rate limits the member role routes per method and guild
+        return (self.action, self.member.guild.id)
+
+    @property
+    def keys(self) -> list[tuple]:
+        # a newer change of the same role of the same member supersedes this one
+        return [(self.member.guild.id, self.member.id, self.role.id)]
+
+    @property
+    def added_roles(self) -> list[discord.Role]:
+        return [self.role] if self.action == ADD else []
+
+    @property
+    def removed_roles(self) -> list[discord.Role]:
+        return [self.role] if self.action == REMOVE else []
+
+    async def apply(self, reason: str = None):
+        if self.action == ADD:
+            await self.member.add_roles(self.role, reason=reason)
+        else:
+            await self.member.remove_roles(self.role, reason=reason)
+
+
+class RoleEdit():
+    """
+    A planned change of several roles of a single member, applied with one member edit instead of one request per role.
+
+    The new role list is computed from the member's roles when it is applied, so roles changed in the meantime by someone else are kept.
+    """
+    action = EDIT
+
+    def __init__(self, member: discord.Member, add: list[discord.Role], remove: list[discord.Role], ref=None):
+        self.member = member
+        self.add = add
+        self.remove = remove
+        self.ref = ref
+
+    @property
+    def bucket(self) -> tuple:
+        return (self.action, self.member.guild.id)
+
+    @property
+    def keys(self) -> list[tuple]:
+        # only a newer change of all of these roles supersedes this edit
+        return [(self.member.guild.id, self.member.id, role.id) for role in (*self.add, *self.remove)]
+
+    @property
+    def added_roles(self) -> list[discord.Role]:
+        return self.add
+
+    @property
+    def removed_roles(self) -> list[discord.Role]:
+        return self.remove
+
+    async def apply(self, reason: str = None):
+        remove_ids = {role.id for role in self.remove}
+        roles = [role for role in self.member.roles if not role.is_default() and role.id not in remove_ids]
+        roles.extend(role for role in self.add if self.member.get_role(role.id) is None)
+        await self.member.edit(roles=roles, reason=reason)
+
+
+def role_change(member: discord.Member, add: list[discord.Role], remove: list[discord.Role], ref=None):
+    """ Returns the cheapest operation for the role changes of `member`: a single add or remove if only one role changes, an edit otherwise. """
+    if len(add) + len(remove) == 1:
+        return RoleOperation(member, (add or remove)[0], ADD if add else REMOVE, ref)
+    return RoleEdit(member, add, remove, ref)
+
+
+class RoleOutcome():
+    """ Result of one executed `RoleOperation`. """
+    DONE = "done"
+    FORBIDDEN = "forbidden"
+    NOT_FOUND = "not_found"
+    FAILED = "failed"
+    # replaced by a newer change before it ran, so it isn't done
+    SUPERSEDED = "superseded"
+
+    def __init__(self, operation: RoleOperation | RoleEdit, status: str, attempts: int, error: Exception = None):
+        self.operation = operation
+        self.status = status
+        self.attempts = attempts
+        self.error = error
+
+    @property
+    def member(self) -> discord.Member:
+        return self.operation.member
+
+    @property
+    def ref(self):
+        return self.operation.ref
+
+
+class RoleResults():
+    """ Per-member outcomes of a `RoleExecutor` run, in the order the operations were planned. """
+    def __init__(self, outcomes: list[RoleOutcome]):
+        self.outcomes = outcomes
+
+    def _select(self, status: str) -> list[RoleOutcome]:
+        return [o for o in self.outcomes if o.status == status]
+
+    @property
+    def added(self) -> list[RoleOutcome]:
+        """ Done operations that added at least one role. """
+        return [o for o in self._select(RoleOutcome.DONE) if o.operation.added_roles]
+
+    @property
+    def removed(self) -> list[RoleOutcome]:
+        """ Done operations that removed at least one role. """
+        return [o for o in self._select(RoleOutcome.DONE) if o.operation.removed_roles]
+
+    @property
+    def forbidden(self) -> list[RoleOutcome]:
+        return self._select(RoleOutcome.FORBIDDEN)
+
+    @property
+    def not_found(self) -> list[RoleOutcome]:
+        return self._select(RoleOutcome.NOT_FOUND)
+
+    @property
+    def failed(self) -> list[RoleOutcome]:
+        return self._select(RoleOutcome.FAILED)
+
+    @property
+    def superseded(self) -> list[RoleOutcome]:
+        return self._select(RoleOutcome.SUPERSEDED)
+
+
+class Reconciliation():
+    """ Difference between the users that should have a role and the users that have it, as sets of user ids. """
+    def __init__(self, to_add: set[int], to_remove: set[int], unchanged: set[int]):
+        self.to_add = to_add
+        self.to_remove = to_remove
+        self.unchanged = unchanged
+
+
+def reconcile(target_ids: Iterable[int], current_ids: Iterable[int]) -> Reconciliation:
+    """
+    Computes which users have to gain or lose a role in linear time.
+
+    `target_ids` are the ids of all users that should have the role, `current_ids` the ids of all users that currently have it. This doesn't touch Discord at all.
+    """
+    target = set(target_ids)
+    current = set(current_ids)
+    return Reconciliation(target - current, current - target, target & current)
+
+
+class RoleExecutor():
+    """
+    Runs planned role changes with a bounded pool of workers.
+
+    Operations sharing a Discord rate-limit bucket are limited to `per_bucket` concurrent requests, so the workers don't just pile up behind discord.py's rate limiter. Rate limits (429) and server errors (5xx) are retried with exponential backoff, everything else is reported as outcome of the operation.
+
+    With a `scheduler`, every operation is submitted to it with `priority`, so jobs of different cogs share the buckets by priority.
+    """
+    def __init__(self, workers: int = 8, per_bucket: int = 4, max_retries: int = 3, backoff: float = 1.0, reason: str = None, progress=None, scheduler: WriteScheduler = None, priority: int = BULK):
+        self.workers = workers
+        self.per_bucket = per_bucket
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.reason = reason
+        # called with (done, total) after every operation
+        self.progress = progress
+        self.scheduler = scheduler
+        self.priority = priority
+
+    async def run(self, operations: list[RoleOperation | RoleEdit], on_outcome=None) -> RoleResults:
+        """ Executes `operations`. `on_outcome` is called with the index of each operation and its outcome as soon as it is done. """
+        operations = list(operations)
+        outcomes : list[RoleOutcome] = [None] * len(operations)
+        buckets : dict[tuple, asyncio.Semaphore] = {}
+        pending = iter(enumerate(operations))
+        done = 0
+
+        async def worker():
+            nonlocal done
+            # the iterator is shared, so every operation is picked up by exactly one worker
+            for index, operation in pending:
+                bucket = buckets.setdefault(operation.bucket, asyncio.Semaphore(self.per_bucket))
+                async with bucket:
+                    outcomes[index] = await self._apply(operation)
+                if on_outcome is not None:
+                    on_outcome(index, outcomes[index])
+                done += 1
+                if self.progress is not None:
+                    self.progress(done, len(operations))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(operations)))))
+        return RoleResults(outcomes)
+
+    async def _apply(self, operation: RoleOperation | RoleEdit) -> RoleOutcome:
+        if self.scheduler is None:
+            outcome = await self._attempt(operation)
+        else:
+            try:
+                outcome = await self.scheduler.submit(lambda: self._attempt(operation), operation.bucket, self.priority, operation.keys)
+            except Superseded:
+                outcome = RoleOutcome(operation, RoleOutcome.SUPERSEDED, 0)
+        metrics.inc('role_mutations_total', action=operation.action, status=outcome.status)
+        return outcome
+
+    async def _attempt(self, operation: RoleOperation | RoleEdit) -> RoleOutcome:
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                with metrics.timer('role_mutation_seconds', action=operation.action):
+                    await operation.apply(self.reason)
+            except discord.Forbidden as e:
+                return RoleOutcome(operation, RoleOutcome.FORBIDDEN, attempts, e)
+            except discord.NotFound as e:
+                return RoleOutcome(operation, RoleOutcome.NOT_FOUND, attempts, e)
+            except (discord.HTTPException, discord.RateLimited) as e:
+                if isinstance(e, discord.RateLimited) or e.status == 429:
+                    metrics.inc('discord_rate_limited_total', action=operation.action)
+                if attempts > self.max_retries or not self._is_transient(e):
+                    return RoleOutcome(operation, RoleOutcome.FAILED, attempts, e)
+                metrics.inc('role_retries_total', action=operation.action)
+                await asyncio.sleep(self._delay(e, attempts))
+            else:
+                return RoleOutcome(operation, RoleOutcome.DONE, attempts)
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        if isinstance(error, discord.RateLimited):
+            return True
+        return error.status == 429 or error.status >= 500
+
+    def _delay(self, error: Exception, attempts: int) -> float:
+        delay = self.backoff * 2 ** (attempts - 1)
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is None and getattr(error, 'response', None) is not None:
+            retry_after = error.response.headers.get('Retry-After')
+        if retry_after is not None:
+            delay = max(delay, float(retry_after))
+        # jitter so retrying workers don't hit the bucket at the same time
+        return delay + random.uniform(0, self.backoff)
+
+
+def log_progress(label: str, step: float = 0.1):
+    """ Returns a progress callback for `RoleExecutor` that prints every `step` of the total. """
+    last = -1
+
+    def progress(done: int, total: int):
+        nonlocal last
+        current = int(done / total / step)
+        if current != last:
+            last = current
+            log.info(f"{label}: {done}/{total}")
+
+    return progress
@@ -0,0 +1,74 @@
+import collections
+import random
+import time
+
+
+class AdaptiveSchedule():
+    """
+    Decides how long a polling loop waits before its next run.
+
+    Runs that found changes halve the interval down to `min_interval`, idle runs double it up to `max_interval`. Failed runs back off exponentially from `interval`, independent of the activity. Every delay is spread by up to `jitter` of itself, so restarts don't line up.
+
+    If `budget` is set, at most that many API calls are made per hour. `spend` records calls as they are made and `next_delay` waits until enough of them are older than an hour.
+    """
+    def __init__(self, interval: float, min_interval: float, max_interval: float, budget: int = None, jitter: float = 0.1):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # failed runs back off from the configured interval, even if the limits exclude it
+        self.retry_interval = interval
+        self.interval = min(max(interval, min_interval), max_interval)
+        self.budget = budget
+        self.jitter = jitter
+        self.failures = 0
+        # monotonic timestamps and sizes of the spent calls of the last hour
+        self._calls : collections.deque[tuple[float, int]] = collections.deque()
+
+    def succeeded(self, changes: int):
+        self.failures = 0
+        if changes > 0:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+
+    def failed(self):
+        self.failures += 1
+
+    def spend(self, calls: int):
+        if calls > 0:
+            self._calls.append((time.monotonic(), calls))
+
+    @property
+    def spent(self) -> int:
+        """ API calls made in the last hour. """
+        self._expire()
+        return sum(calls for _, calls in self._calls)
+
+    def has_budget(self) -> bool:
+        return self.budget is None or self.spent < self.budget
+
+    def next_delay(self) -> float:
+        if self.failures:
+            delay = min(self.max_interval, self.retry_interval * 2 ** (self.failures - 1))
+        else:
+            delay = self.interval
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(delay, self._budget_delay())
+
+    def _budget_delay(self) -> float:
+        """ Seconds until the calls of the last hour fit into the budget again. """
+        if self.budget is None:
+            return 0.0
+        spent = self.spent
+        wait = 0.0
+        for timestamp, calls in self._calls:
+            if spent < self.budget:
+                break
+            # these calls leave the window an hour after they were made
+            spent -= calls
+            wait = timestamp + 3600 - time.monotonic()
+        return max(0.0, wait)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._calls and self._calls[0][0] <= now - 3600:
+            self._calls.popleft()
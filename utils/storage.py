@@ -0,0 +1,38 @@
+import json
+import os
+import pathlib
+import tempfile
+
+
+def read_json(path: str, default=None) -> object:
+    """ Reads JSON from `path`, returns `default` if the file doesn't exist yet. """
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(path: str, data: object):
+    """ Writes `data` as JSON to `path` atomically, see `write_text`. """
+    write_text(path, json.dumps(data))
+
+
+def write_text(path: str, text: str):
+    """
+    Writes `text` to `path` atomically.
+
+    The text is written to a temporary file in the same directory first, which then replaces `path`. A crash can never leave a half written file behind.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,84 @@
+import asyncio
+import hmac
+import logging
+from aiohttp import web
+from utils.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Webhook-Secret'
+
+
+class ChangeReceiver():
+    """
+    Embedded HTTP endpoint for change notifications from Webling or a relay, served on the bot's event loop.
+
+    Notifications are POSTed to `path` as JSON, e.g. `{"member": [123, 456]}`, with `secret` in the `X-Webhook-Secret` header. A notification without ids just reports that something changed.
+
+    Bursts are coalesced: `on_changes` is awaited with all member ids collected once no notification arrived for `debounce` seconds, but at most `max_delay` seconds after the first one. Notifications that arrive while it runs are collected for the next call.
+    """
+    def __init__(self, on_changes, port: int, host: str = '127.0.0.1', path: str = '/webling/changes', secret: str = None, debounce: float = 5.0, max_delay: float = 30.0):
+        self.on_changes = on_changes
+        self.port = port
+        self.host = host
+        self.path = path
+        self.secret = secret
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._pending : set[int] = set()
+        # loop time of the first pending notification, None if nothing is pending
+        self._first : float = None
+        self._deadline : float = None
+        self._runner : web.AppRunner = None
+        self._task : asyncio.Task = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Receiving Webling changes on http://%s:%d%s", self.host, self.port, self.path)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.secret is not None and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            metrics.inc('webling_notifications_total', status="unauthorized")
+            return web.json_response({'error': 'unauthorized'}, status=401)
+        try:
+            data = await request.json() if request.can_read_body else {}
+            member_ids = [int(member_id) for member_id in data.get('member', [])]
+        except (ValueError, TypeError, AttributeError):
+            metrics.inc('webling_notifications_total', status="invalid")
+            return web.json_response({'error': 'invalid notification'}, status=400)
+
+        metrics.inc('webling_notifications_total', status="accepted")
+        self._pending.update(member_ids)
+        self._schedule()
+        return web.json_response({'pending': len(self._pending)}, status=202)
+
+    def _schedule(self):
+        now = asyncio.get_running_loop().time()
+        if self._first is None:
+            self._first = now
+        self._deadline = min(now + self.debounce, self._first + self.max_delay)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while self._first is not None:
+            delay = self._deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            member_ids, self._pending, self._first = self._pending, set(), None
+            try:
+                await self.on_changes(member_ids)
+            except Exception:
+                log.exception("Handling Webling change notification failed.")
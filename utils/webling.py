@@ -0,0 +1,329 @@
+import asyncio
+import codecs
+import collections
+import json
+import time
+import aiohttp
+from utils.metrics import metrics
+
+
+class WeblingError(RuntimeError):
+    """Raise when a Webling API request fails."""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f'Request failed with status code {status}')
+        self.status = status
+        self.url = url
+
+
+class WeblingClient():
+    """
+    Async client for the Webling REST API.
+
+    Owns one pooled keep-alive session which is shared by every request, so a sync never blocks the event loop and reuses its connections. The number of requests in flight is capped by `max_concurrency`. `on_request` is called whenever a request is sent, e.g. to count it against a budget.
+    """
+    def __init__(self, api_url: str, apikey: str, timeout: float = 30.0, connect_timeout: float = 10.0, max_concurrency: int = 4, on_request=None):
+        self.api_url = api_url
+        self.headers = {'apikey': apikey}
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_concurrency = max_concurrency
+        self.on_request = on_request
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session : aiohttp.ClientSession = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # session has to be created inside the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(headers=self.headers, timeout=self.timeout, connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, path: str, params: dict = None) -> object:
+        """ Sends a GET request to `path` relative to the API url and returns the decoded JSON body. """
+        session = self._get_session()
+        endpoint = _endpoint(path)
+        async with self._semaphore:
+            self._sent()
+            with metrics.timer('webling_request_seconds', endpoint=endpoint):
+                async with session.get(self.api_url + path, params=params) as response:
+                    metrics.inc('webling_requests_total', endpoint=endpoint, status=response.status)
+                    if response.status != 200:
+                        raise WeblingError(response.status, str(response.url))
+                    body = await response.read()
+                    metrics.inc('webling_bytes_total', len(body), endpoint=endpoint)
+                    return json.loads(body)
+
+    async def stream(self, path: str, params: dict = None, chunk_size: int = 64 * 1024):
+        """
+        Sends a GET request like `get`, but parses a JSON array response incrementally and yields its items as soon as they are complete.
+
+        Only one item has to be held in memory at a time instead of the whole decoded response.
+        """
+        session = self._get_session()
+        endpoint = _endpoint(path)
+        async with self._semaphore:
+            self._sent()
+            with metrics.timer('webling_request_seconds', endpoint=endpoint):
+                async with session.get(self.api_url + path, params=params) as response:
+                    metrics.inc('webling_requests_total', endpoint=endpoint, status=response.status)
+                    if response.status != 200:
+                        raise WeblingError(response.status, str(response.url))
+
+                    parser = _ArrayParser()
+                    async for data in response.content.iter_chunked(chunk_size):
+                        metrics.inc('webling_bytes_total', len(data), endpoint=endpoint)
+                        for item in parser.feed(data):
+                            yield item
+                    for item in parser.close():
+                        yield item
+
+    def _sent(self):
+        if self.on_request is not None:
+            self.on_request()
+
+    async def get_many(self, object_type: str, ids: list[int], chunk_size: int = 100) -> dict[int, object]:
+        """
+        Fetches many objects of `object_type` by id with as few requests as possible.
+
+        The ids are split into chunks which are fetched with one filtered `format=full` list request each. Chunks run in parallel, bounded by `max_concurrency`. Returns a dict mapping id to object; ids that don't exist (e.g. deleted members) are missing from it.
+        """
+        ids = list(dict.fromkeys(map(int, ids)))
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+        async def fetch_chunk(chunk):
+            params = {
+                'filter': f"$id IN ({', '.join(map(str, chunk))})",
+                'format': 'full',
+            }
+            return await self.get("/" + object_type, params=params)
+
+        objects = {}
+        for data in await asyncio.gather(*map(fetch_chunk, chunks)):
+            for obj in data or []:
+                objects[int(obj['id'])] = obj
+        return objects
+
+
+# seconds objects are cached, by object type; other types aren't cached
+CACHE_TTLS = {
+    'member': 5 * 60,
+}
+
+
+class WeblingCache():
+    """
+    Caches the objects `WeblingClient.get_many` fetches in memory, each under its type and id.
+
+    Entries expire after the TTL of their object type, see `CACHE_TTLS`, and the least recently used ones are evicted once there are more than `maxsize`. Objects that are being fetched already are awaited instead of being fetched twice.
+
+    The changes feed depends on time rather than on its path and is never cached. Pass every changes response to `invalidate_changes`, so the objects it reports are fetched again.
+    """
+    def __init__(self, client: WeblingClient, maxsize: int = 1024, ttls: dict[str, float] = CACHE_TTLS):
+        self.client = client
+        self.maxsize = maxsize
+        self.ttls = ttls
+        # (object type, id) -> (expiry, object), least recently used first
+        self._entries : collections.OrderedDict[tuple[str, int], tuple[float, object]] = collections.OrderedDict()
+        # (object type, id) -> task fetching the chunk the object is part of
+        self._in_flight : dict[tuple[str, int], asyncio.Task] = {}
+
+    async def get_many(self, object_type: str, ids: list[int], chunk_size: int = 100) -> dict[int, object]:
+        """ Like `WeblingClient.get_many`, but cached objects are served from the cache and only the others are fetched. The objects must not be modified. """
+        ttl = self.ttls.get(object_type)
+        if ttl is None:
+            return await self.client.get_many(object_type, ids, chunk_size)
+
+        objects = {}
+        # id -> task fetching the object
+        tasks : dict[int, asyncio.Task] = {}
+        missing = []
+        for object_id in dict.fromkeys(map(int, ids)):
+            key = (object_type, object_id)
+            data = self._lookup(key)
+            if data is not None:
+                metrics.inc('webling_cache_total', endpoint=object_type, result="hit")
+                objects[object_id] = data
+            elif key in self._in_flight:
+                metrics.inc('webling_cache_total', endpoint=object_type, result="shared")
+                tasks[object_id] = self._in_flight[key]
+            else:
+                metrics.inc('webling_cache_total', endpoint=object_type, result="miss")
+                missing.append(object_id)
+
+        if missing:
+            task = asyncio.create_task(self._fetch_many(object_type, missing, chunk_size, ttl))
+            for object_id in missing:
+                self._in_flight[(object_type, object_id)] = task
+                tasks[object_id] = task
+
+        for task in set(tasks.values()):
+            # a cancelled caller must not cancel the request of the others
+            fetched = await asyncio.shield(task)
+            objects.update((object_id, fetched[object_id]) for object_id, t in tasks.items() if t is task and object_id in fetched)
+        return objects
+
+    def invalidate(self, object_type: str, ids: list[int]):
+        """ Evicts the cached objects of `object_type` with `ids`. """
+        for object_id in ids:
+            self._entries.pop((object_type, int(object_id)), None)
+
+    def invalidate_changes(self, changes: object):
+        """ Evicts the objects a changes response reports as changed or deleted. """
+        for objects in (changes.get('objects'), changes.get('deleted')):
+            # webling sends an empty list if nothing changed
+            if isinstance(objects, dict):
+                for object_type, ids in objects.items():
+                    self.invalidate(object_type, ids)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: tuple[str, int]) -> object:
+        """ Returns the cached object of `key`, None if there is none or it expired. """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expiry, data = entry
+        if expiry <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    async def _fetch_many(self, object_type: str, ids: list[int], chunk_size: int, ttl: float) -> dict[int, object]:
+        try:
+            objects = await self.client.get_many(object_type, ids, chunk_size)
+        finally:
+            for object_id in ids:
+                del self._in_flight[(object_type, object_id)]
+        expiry = time.monotonic() + ttl
+        for object_id, data in objects.items():
+            self._entries[(object_type, object_id)] = (expiry, data)
+            self._entries.move_to_end((object_type, object_id))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return objects
+
+
+def _endpoint(path: str) -> str:
+    # metrics are labeled by object type, not by id
+    return path.strip('/').split('/')[0]
+
+
+class WeblingMember():
+    """
+    Compact record of the fields of a Webling member the sync needs.
+
+    Parsed once from the Webling JSON, with the Discord-ID as int, the username stripped and the membergroups as frozenset, so the hot loops don't have to parse anything again.
+    """
+    __slots__ = ('id', 'member_number', 'discord_id', 'discord_name', 'groups')
+
+    def __init__(self, id: int, member_number: str = None, discord_id: int = None, discord_name: str = None, groups: frozenset[int] = frozenset()):
+        self.id = id
+        self.member_number = member_number
+        self.discord_id = discord_id
+        self.discord_name = discord_name
+        self.groups = groups
+
+    @classmethod
+    def parse(cls, member: object):
+        """ Creates a record from a Webling member object. """
+        properties = member.get('properties', {})
+        return cls(
+            int(member['id']),
+            _parse_str(properties.get('Mitglieder ID')),
+            _parse_discord_id(properties.get('Discord-ID')),
+            _parse_discord_name(properties.get('Discord-Benutzername')),
+            frozenset(map(int, member.get('parents', []))),
+        )
+
+    def in_groups(self, groups: frozenset[int]) -> bool:
+        """ Checks if the member is in at least one of `groups`. """
+        return not self.groups.isdisjoint(groups)
+
+    def __repr__(self) -> str:
+        return f"WeblingMember(id={self.id}, member_number={self.member_number!r}, discord_id={self.discord_id}, discord_name={self.discord_name!r})"
+
+
+def _parse_str(value) -> str:
+    # Webling returns empty properties as empty strings or null
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _parse_discord_id(value) -> int:
+    value = _parse_str(value)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_discord_name(value) -> str:
+    value = _parse_str(value)
+    if value is None:
+        return None
+    return value.lstrip('@') or None
+
+
+class _ArrayParser():
+    """ Incremental parser for the items of a top-level JSON array. """
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._started = False
+        self._finished = False
+
+    def feed(self, data: bytes, final: bool = False) -> list:
+        self._buffer += self._text.decode(data, final)
+        items = []
+        pos = 0
+        buffer = self._buffer
+        while not self._finished:
+            # skip whitespace and separators
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not self._started:
+                if buffer[pos] != '[':
+                    raise ValueError("Response is not a JSON array")
+                self._started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                self._finished = True
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # item is incomplete, wait for more data
+                break
+            if end == len(buffer) and not final:
+                # scalars could continue in the next chunk
+                break
+            if end < len(buffer) and buffer[end] not in ' \t\r\n,]':
+                if final:
+                    raise ValueError("Response is not a valid JSON array")
+                # a number cut at its decimal point or exponent, e.g. `1.` of `1.5`
+                break
+            items.append(item)
+            pos = end
+        self._buffer = buffer[pos:]
+        return items
+
+    def close(self) -> list:
+        items = self.feed(b'', final=True)
+        if not self._finished:
+            raise ValueError("Response ended before the JSON array was complete")
+        return items
@@ -0,0 +1,103 @@
+import asyncio
+import heapq
+import itertools
+import time
+from utils.metrics import metrics
+
+# priority classes of writes, lower runs first
+INTERACTIVE = 0
+BULK = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk", BACKGROUND: "background"}
+
+
+class Superseded(Exception):
+    """Raise when a queued write was replaced by a newer write covering all of its keys."""
+
+
+class _Bucket():
+    def __init__(self):
+        self.running = 0
+        # heap of [priority, sequence, future, keys] of the waiting writes
+        self.queue : list[list] = []
+
+
+class WriteScheduler():
+    """
+    Bot-wide scheduler of Discord API writes, shared by all cogs.
+
+    Every write names its rate-limit bucket, of which at most `per_bucket` writes run at once. When a slot frees up, the waiting write of the highest priority class goes next, first come first served within a class. So a role grant for a joining member overtakes the queued operations of a bulk sync, while writes in other buckets don't wait for each other at all.
+
+    Writes name the things they change as `keys`, e.g. one `(guild, member, role)` per role they set. A newer write supersedes a waiting write if its keys cover all keys of the waiting one, e.g. removing a role cancels a queued grant of the same role to the same member. A waiting write that also changes something else still runs. Writes that already started always finish.
+    """
+    def __init__(self, per_bucket: int = 4):
+        self.per_bucket = per_bucket
+        self._buckets : dict[object, _Bucket] = {}
+        # key -> queue entries of the waiting writes with that key
+        self._waiting : dict[object, list[list]] = {}
+        self._sequence = itertools.count()
+
+    async def submit(self, write, bucket: object, priority: int = BULK, keys: list = ()):
+        """
+        Awaits the coroutine function `write` once `bucket` has a free slot and returns its result.
+
+        Raises `Superseded` if a newer write covering all of its `keys` is submitted before this one started.
+        """
+        state = self._buckets.setdefault(bucket, _Bucket())
+        keys = frozenset(keys)
+        if keys:
+            self._supersede(keys)
+
+        start = time.perf_counter()
+        if state.running < self.per_bucket and not state.queue:
+            state.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            entry = [priority, next(self._sequence), future, keys]
+            heapq.heappush(state.queue, entry)
+            for key in keys:
+                self._waiting.setdefault(key, []).append(entry)
+            try:
+                # resolved once a finished write hands over its slot
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # the slot was handed over already
+                    self._release(bucket)
+                raise
+            finally:
+                for key in keys:
+                    self._unwait(key, entry)
+        metrics.observe('discord_write_wait_seconds', time.perf_counter() - start, priority=PRIORITY_NAMES[priority])
+
+        try:
+            return await write()
+        finally:
+            self._release(bucket)
+
+    def _supersede(self, keys: frozenset):
+        for key in keys:
+            for entry in self._waiting.get(key, ()):
+                # writes that change something else as well aren't replaced
+                if entry[3] <= keys and not entry[2].done():
+                    entry[2].set_exception(Superseded())
+                    metrics.inc('discord_writes_superseded_total', priority=PRIORITY_NAMES[entry[0]])
+
+    def _unwait(self, key: object, entry: list):
+        entries = [e for e in self._waiting[key] if e is not entry]
+        if entries:
+            self._waiting[key] = entries
+        else:
+            del self._waiting[key]
+
+    def _release(self, bucket: object):
+        state = self._buckets[bucket]
+        while state.queue:
+            future = heapq.heappop(state.queue)[2]
+            # superseded and cancelled writes don't need the slot anymore
+            if not future.done():
+                future.set_result(None)
+                return
+        state.running -= 1
+        if state.running == 0:
+            del self._buckets[bucket]